@@ -31,11 +31,19 @@ class Settings(BaseSettings):
 
     # LLM settings
     LLM_MODEL: str = Field(default="mixtral-8x7b-32768")
+    INTENT_MODEL: str = Field(default="llama-3.1-8b-instant")  # Small model for intent classification
     GROQ_API_KEY: str = Field(default="")
     OPENAI_API_KEY: str = Field(default="")
 
     # Vector database settings
     CHROMA_PATH: str = Field(default="./data/chroma")
+    EMBEDDING_MODEL: str = Field(default="all-MiniLM-L6-v2")  # Shared with ingestion/ncert_ingest.py; changing it requires a re-ingest
+    # HNSW index build parameters for the ncert_corpus collection. Only used when
+    # the collection is created; changing them requires deleting it and re-ingesting.
+    HNSW_M: int = Field(default=24)
+    HNSW_CONSTRUCTION_EF: int = Field(default=128)
+    # Query-time HNSW setting, applied to the existing collection on startup
+    HNSW_SEARCH_EF: int = Field(default=100)
 
     # Security
     SECRET_KEY: str = Field(default="")  # Must be set in .env file
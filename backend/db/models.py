@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Boolean, Integer, DateTime, ForeignKey, JSON, Date, Text, Numeric
+from sqlalchemy import Column, String, Boolean, Integer, DateTime, ForeignKey, JSON, Date, Text, Numeric, Index
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.declarative import declarative_base
 import uuid
@@ -22,7 +22,11 @@ class User(Base):
 
 class StudyPlan(Base):
     __tablename__ = "study_plans"
-    __table_args__ = {'schema': 'MentoraAI'}
+    __table_args__ = (
+        # Active-plan lookups and the archive UPDATE filter on (user_id, status)
+        Index('idx_study_plans_user_status', 'user_id', 'status'),
+        {'schema': 'MentoraAI'}
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = Column(UUID(as_uuid=True), ForeignKey('MentoraAI.users.id'), nullable=False)
@@ -35,7 +39,11 @@ class StudyPlan(Base):
 
 class StudySession(Base):
     __tablename__ = "study_sessions"
-    __table_args__ = {'schema': 'MentoraAI'}
+    __table_args__ = (
+        # Progress and analytics aggregate a user's sessions by completion time
+        Index('idx_study_sessions_user_completed', 'user_id', 'completed_at'),
+        {'schema': 'MentoraAI'}
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = Column(UUID(as_uuid=True), ForeignKey('MentoraAI.users.id'), nullable=False)
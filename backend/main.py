@@ -8,6 +8,7 @@ from backend.routers import (
     telegram_router
 )
 from backend.config import settings
+from backend.services.telegram_service import telegram_service
 from backend.utils.logger import setup_logging
 
 # Set up logging
@@ -41,6 +42,11 @@ app.include_router(tracker_router.router)
 # Platform-specific webhook routers
 app.include_router(telegram_router.router, prefix="/telegram", tags=["telegram"])
 
+@app.on_event("shutdown")
+async def close_http_clients():
+    """Close pooled HTTP connections on shutdown."""
+    await telegram_service.aclose()
+
 @app.get("/")
 def root():
     """Root endpoint that returns a welcome message."""
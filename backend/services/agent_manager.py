@@ -38,11 +38,11 @@ class AgentManager:
         from ..services.rag_service import RAGService
         from ..services.llm_service import LLMService
         
-        rag_service = RAGService()
         llm_service = LLMService()
+        rag_service = RAGService(llm_service=llm_service)
         
         self.agents: Dict[str, BaseAgent] = {
-            "tutor": TutorAgent(),
+            "tutor": TutorAgent(rag_service=rag_service),
             "quiz": QuizAgent(rag_service=rag_service, llm_service=llm_service),
             "planner": PlannerAgent(),
             "tracker": TrackerAgent()
@@ -1,5 +1,7 @@
 import os
+import asyncio
 import logging
+import threading
 from typing import Optional, Dict, Any, List
 from dotenv import load_dotenv
 from groq import Groq
@@ -14,6 +16,22 @@ logger = logging.getLogger(__name__)
 class LLMService:
     """Service for interacting with the Groq API for text generation."""
     
+    _instances: Dict[tuple, "LLMService"] = {}
+    _lock = threading.Lock()
+    
+    def __new__(cls, model: str = "qwen/qwen3-32b", temperature: float = 0.7):
+        """Share one instance (and Groq client) per model/temperature pair."""
+        key = (model, temperature)
+        instance = cls._instances.get(key)
+        if instance is None:
+            with cls._lock:
+                instance = cls._instances.get(key)
+                if instance is None:
+                    instance = super().__new__(cls)
+                    instance._initialized = False
+                    cls._instances[key] = instance
+        return instance
+    
     def __init__(self, model: str = "qwen/qwen3-32b", temperature: float = 0.7):
         """
         Initialize the LLM service with Groq API.
@@ -22,6 +40,9 @@ class LLMService:
             model: The model to use for text generation
             temperature: Controls randomness in the response (0.0 to 1.0)
         """
+        if self._initialized:
+            return
+        
         self.model = model
         self.temperature = temperature
         self.api_key = settings.GROQ_API_KEY
@@ -29,6 +50,8 @@ class LLMService:
         
         if not self.api_key:
             logger.warning("GROQ_API_KEY not found in environment variables")
+        
+        self._initialized = True
     
     def generate_text(self, prompt: str, max_tokens: int = 500) -> str:
         """
@@ -96,6 +119,6 @@ class LLMService:
             {"role": "user", "content": prompt}
         ]
         
-        # Since Groq client is synchronous, we can just call it directly.
-        # In a high-load production app, we'd run this in a thread pool.
-        return self.generate_chat(messages)
+        # The Groq client is synchronous; run it in a worker thread so
+        # concurrent requests don't block the event loop
+        return await asyncio.to_thread(self.generate_chat, messages)
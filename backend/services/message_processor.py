@@ -3,12 +3,19 @@ AI-powered message processing service for handling incoming WhatsApp messages.
 Uses transformer models for natural language understanding and intent classification.
 """
 import re
+import asyncio
 import logging
 import json
-from typing import Dict, Any, Optional, List, Tuple
+import threading
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import Dict, Any, Mapping, Optional, List, Tuple
 from enum import Enum
 from dataclasses import dataclass
+from functools import cached_property
 from .llm_service import LLMService
+from ..config import settings
+from ..utils.keyword_matcher import KeywordMatcher
 
 logger = logging.getLogger(__name__)
 
@@ -24,21 +31,31 @@ class IntentType(str, Enum):
     FEEDBACK = "feedback"    # User feedback
     UNKNOWN = "unknown"      # Unclassified intents
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class IntentResult:
     """Container for intent classification results."""
     intent: str
     confidence: float
-    entities: Dict[str, Any]
+    entities: Mapping[str, Any]
     needs_clarification: bool = False
     clarification_prompt: Optional[str] = None
+    
+    def __post_init__(self):
+        # Results are shared between callers (the unknown result and the
+        # classifier caches), so the entities are copied into a read-only view
+        object.__setattr__(self, "entities", MappingProxyType(dict(self.entities)))
+
+# Shared result for empty messages and failed classifications (immutable,
+# see IntentResult.__post_init__)
+_UNKNOWN_RESULT = IntentResult(IntentType.UNKNOWN, 0.0, {})
 
 class GroqIntentClassifier:
     """Intent classifier using Groq LLM for superior reasoning and understanding."""
     
     def __init__(self):
         """Initialize with LLM service."""
-        self.llm_service = LLMService()
+        # Picking one of eight labels does not need the large reasoning model
+        self.llm_service = LLMService(model=settings.INTENT_MODEL)
         logger.info("Initializing Groq Intent Classifier")
         
         self.intent_definitions = {
@@ -52,6 +69,52 @@ class GroqIntentClassifier:
             IntentType.FEEDBACK: "User gives feedback or reports issues."
         }
 
+        # LLM results keyed on normalized message text (bounded LRU)
+        self.result_cache: "OrderedDict[str, IntentResult]" = OrderedDict()
+        self.result_cache_size = 4096
+        # In-flight LLM classifications, so concurrent identical messages share one call
+        self.pending: Dict[str, asyncio.Future] = {}
+
+        # Simple-pattern results (None for no match) keyed on normalized message text
+        self.simple_cache: "OrderedDict[str, Optional[IntentResult]]" = OrderedDict()
+        self.simple_cache_size = 4096
+
+        # Obvious intents answered without an LLM call
+        self.simple_patterns = {
+            IntentType.GREETING: [re.compile(r'\b(hi|hello|hey|namaste)\b')],
+            IntentType.THANKS: [re.compile(r'\b(thanks|thank you)\b')],
+            IntentType.HELP: [re.compile(r'\b(help|commands|menu)\b')]
+        }
+
+        # The classification prompt only varies by the user message, so the
+        # fixed text around it is assembled once here
+        self.prompt_head = (
+            "Classify this user message into one intent and extract entities.\n\n"
+            'User Message: "'
+        )
+        self.prompt_tail = """"
+
+Intents:
+- tutor: Educational questions/explanations
+- quiz: Wants to take a quiz/test
+- plan: Create/view study plan
+- track: View progress/stats
+- greeting: Hi/hello
+- thanks: Thank you
+- help: Needs help
+- feedback: Giving feedback
+
+Return JSON:
+{
+    "intent": "intent_name",
+    "confidence": 0.95,
+    "entities": {"topic": "...", "subject": "..."},
+    "needs_clarification": false,
+    "clarification_prompt": null
+}
+
+Only include entities that are mentioned. If quiz intent but no topic, set needs_clarification=true."""
+
         self.default_responses = {
             IntentType.GREETING: [
                 "Hello! I'm your AI UPSC Mentor. How can I assist you with your UPSC preparation today? ",
@@ -77,39 +140,42 @@ class GroqIntentClassifier:
         """
         Detect intent using Groq LLM.
         """
-        if not message or not message.strip():
-            return IntentResult(IntentType.UNKNOWN, 0.0, {})
+        message = message.strip() if message else ""
+        if not message:
+            return _UNKNOWN_RESULT
+
+        # Lowercased once; used for the pattern check and as the cache key
+        cache_key = message.lower()
 
         # Check for simple patterns first to save LLM calls
-        simple_result = self._check_simple_patterns(message)
+        simple_result = self._match_simple_patterns(cache_key)
         if simple_result:
             return simple_result
 
-        try:
-            prompt = f"""Classify this user message into one intent and extract entities.
-
-User Message: "{message}"
+        cached = self.result_cache.get(cache_key)
+        if cached is not None:
+            self.result_cache.move_to_end(cache_key)
+            return cached
 
-Intents:
-- tutor: Educational questions/explanations
-- quiz: Wants to take a quiz/test
-- plan: Create/view study plan
-- track: View progress/stats
-- greeting: Hi/hello
-- thanks: Thank you
-- help: Needs help
-- feedback: Giving feedback
+        pending = self.pending.get(cache_key)
+        if pending is not None:
+            return await asyncio.shield(pending)
 
-Return JSON:
-{{
-    "intent": "intent_name",
-    "confidence": 0.95,
-    "entities": {{"topic": "...", "subject": "..."}},
-    "needs_clarification": false,
-    "clarification_prompt": null
-}}
+        future = asyncio.get_running_loop().create_future()
+        self.pending[cache_key] = future
+        try:
+            result = await self._classify_with_llm(message, cache_key)
+            future.set_result(result)
+            return result
+        finally:
+            if not future.done():
+                future.set_result(_UNKNOWN_RESULT)
+            del self.pending[cache_key]
 
-Only include entities that are mentioned. If quiz intent but no topic, set needs_clarification=true."""
+    async def _classify_with_llm(self, message: str, cache_key: str) -> IntentResult:
+        """Classify a message with the Groq LLM and cache successful results."""
+        try:
+            prompt = self.prompt_head + message + self.prompt_tail
 
             response_text = await self.llm_service.get_response(
                 prompt, 
@@ -121,7 +187,7 @@ Only include entities that are mentioned. If quiz intent but no topic, set needs
             
             if not response_text or not response_text.strip():
                 logger.error("Empty response from LLM")
-                return IntentResult(IntentType.UNKNOWN, 0.0, {})
+                return _UNKNOWN_RESULT
             
             # Parse JSON response
             # Clean up potential markdown code blocks and thinking tags
@@ -150,37 +216,45 @@ Only include entities that are mentioned. If quiz intent but no topic, set needs
             
             result_data = json.loads(clean_json)
             
-            return IntentResult(
+            result = IntentResult(
                 intent=result_data.get("intent", IntentType.UNKNOWN),
                 confidence=result_data.get("confidence", 0.0),
                 entities=result_data.get("entities", {}),
                 needs_clarification=result_data.get("needs_clarification", False),
                 clarification_prompt=result_data.get("clarification_prompt")
             )
+            
+            # Only successful classifications are cached; failures are retried
+            self.result_cache[cache_key] = result
+            if len(self.result_cache) > self.result_cache_size:
+                self.result_cache.popitem(last=False)
+            
+            return result
 
         except json.JSONDecodeError as e:
             logger.error(f"JSON parsing failed: {str(e)}")
             logger.error(f"Response was: {response_text if 'response_text' in locals() else 'No response'}")
-            return IntentResult(IntentType.UNKNOWN, 0.0, {})
+            return _UNKNOWN_RESULT
         except Exception as e:
-            logger.error(f"Groq intent detection failed: {str(e)}", exc_info=True)
-            return IntentResult(IntentType.UNKNOWN, 0.0, {})
+            # No traceback: this runs per message and the fallback result is expected
+            logger.warning(f"Groq intent detection failed: {str(e)}")
+            return _UNKNOWN_RESULT
 
-    def _check_simple_patterns(self, message: str) -> Optional[IntentResult]:
-        """Quick regex check for obvious intents."""
-        message_lower = message.lower()
+    def _match_simple_patterns(self, message_lower: str) -> Optional[IntentResult]:
+        """Match normalized text against the simple patterns (cached per message)."""
+        if message_lower in self.simple_cache:
+            self.simple_cache.move_to_end(message_lower)
+            return self.simple_cache[message_lower]
         
-        patterns = {
-            IntentType.GREETING: [r'\b(hi|hello|hey|namaste)\b'],
-            IntentType.THANKS: [r'\b(thanks|thank you)\b'],
-            IntentType.HELP: [r'\b(help|commands|menu)\b']
-        }
-
-        for intent, regex_list in patterns.items():
-            for pattern in regex_list:
-                if re.search(pattern, message_lower):
-                    return IntentResult(intent, 1.0, {})
-        return None
+        result = None
+        for intent, regex_list in self.simple_patterns.items():
+            if any(pattern.search(message_lower) for pattern in regex_list):
+                result = IntentResult(intent, 1.0, {})
+                break
+        self.simple_cache[message_lower] = result
+        if len(self.simple_cache) > self.simple_cache_size:
+            self.simple_cache.popitem(last=False)
+        return result
 
     def get_default_response(self, intent: str) -> Optional[str]:
         """Get a default response for simple intents."""
@@ -188,13 +262,6 @@ Only include entities that are mentioned. If quiz intent but no topic, set needs
             import random
             return random.choice(self.default_responses[intent])
         return None
-    
-    def get_default_response(self, intent: str) -> Optional[str]:
-        """Get a default response for simple intents."""
-        if intent in self.default_responses:
-            import random
-            return random.choice(self.default_responses[intent])
-        return None
 
 class SimpleIntentClassifier:
     """Simple fallback intent classifier when AI is not available."""
@@ -235,93 +302,133 @@ class SimpleIntentClassifier:
                 r"(this is not working|i don't like this|this is great|i love this|improvement|how can i improve|rate this)",
             ]
         }
-        self.compiled_patterns = {
-            intent: [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
-            for intent, patterns in self.patterns.items()
-        }
+        # All intents in one regex. Each intent is a lookahead from the start
+        # of the message, so alternation order keeps intent priority and a
+        # single search() call reports the winner via its named group.
+        self.intent_pattern = re.compile(
+            "^(?:" + "|".join(
+                f"(?=.*?(?P<{intent.name}>" + "|".join(f"(?:{pattern})" for pattern in patterns) + "))"
+                for intent, patterns in self.patterns.items()
+            ) + ")",
+            re.IGNORECASE | re.DOTALL
+        )
+        
+        # Known subjects, matched in a single pass over the message
+        self.subjects = (
+            "history", "geography", "polity", "economics", 
+            "science", "environment", "current affairs", "csat",
+            "mathematics", "general studies", "essay", "ethics",
+            "international relations", "governance", "social justice"
+        )
+        self.subject_matcher = KeywordMatcher({subj: subj for subj in self.subjects})
+        
+        # Difficulty keywords; the named group that matches is the level
+        self.difficulty_pattern = re.compile(
+            r"\b(?:(?P<easy>easy|basic|simple|beginner)"
+            r"|(?P<medium>medium|moderate|intermediate)"
+            r"|(?P<hard>hard|difficult|challenging|advanced|tough))\b"
+        )
+        
+        # Results keyed on the stripped message (bounded LRU, repeat messages are common)
+        self.intent_cache: "OrderedDict[str, IntentResult]" = OrderedDict()
+        self.intent_cache_size = 4096
     
     def detect_intent(self, message: str) -> IntentResult:
         """Simple pattern-based intent detection."""
-        if not message or not message.strip():
+        message = message.strip() if message else ""
+        if not message:
+            return _UNKNOWN_RESULT
+        
+        result = self.intent_cache.get(message)
+        if result is not None:
+            self.intent_cache.move_to_end(message)
+            return result
+        
+        result = self._compute_intent(message)
+        self.intent_cache[message] = result
+        if len(self.intent_cache) > self.intent_cache_size:
+            self.intent_cache.popitem(last=False)
+        return result
+    
+    def _compute_intent(self, message: str) -> IntentResult:
+        """
+        Pattern-match a stripped message.
+        
+        Results are cached in intent_cache and handed to every caller with that
+        message, so their entities are read-only and hold tuples rather than lists.
+        """
+        # First intent (in declaration order) with a matching pattern wins.
+        # The pattern is case-insensitive, so only matched messages are lowercased.
+        match = self.intent_pattern.search(message)
+        if match:
+            intent = IntentType[match.lastgroup]
+            entities = self._extract_entities(message.lower(), intent)
             return IntentResult(
-                intent=IntentType.UNKNOWN,
-                confidence=0.0,
-                entities={}
+                intent=intent,
+                confidence=0.8,  # Lower confidence for pattern matching
+                entities=entities
             )
-            
-        message_lower = message.lower()
         
-        # Check each intent's patterns
-        for intent, patterns in self.compiled_patterns.items():
-            for pattern in patterns:
-                if pattern.search(message_lower):
-                    entities = self._extract_entities(message_lower, intent)
-                    return IntentResult(
-                        intent=intent,
-                        confidence=0.8,  # Lower confidence for pattern matching
-                        entities=entities
-                    )
-        
-        # Default to TUTOR if no pattern matches but looks like a question
-        if '?' in message or any(word in message_lower for word in ['what', 'when', 'where', 'who', 'why', 'how']):
+        # Default to TUTOR if no pattern matches but looks like a question.
+        # Question words are already covered by the TUTOR patterns above.
+        if '?' in message:
             return IntentResult(
                 intent=IntentType.TUTOR,
                 confidence=0.6,
-                entities={"question": message.strip()}
+                entities={"question": message}
             )
             
-        return IntentResult(
-            intent=IntentType.UNKNOWN,
-            confidence=0.0,
-            entities={}
-        )
+        return _UNKNOWN_RESULT
     
-    def _extract_entities(self, message: str, intent: str) -> Dict[str, Any]:
+    def _extract_entities(self, message_lower: str, intent: str) -> Dict[str, Any]:
         """Simple entity extraction."""
         entities = {}
         
         # Extract potential topics/subjects
-        subjects = [
-            "history", "geography", "polity", "economics", 
-            "science", "environment", "current affairs", "csat",
-            "mathematics", "general studies", "essay", "ethics",
-            "international relations", "governance", "social justice"
-        ]
-        
-        mentioned_subjects = [
-            subj for subj in subjects 
-            if subj in message.lower()
-        ]
+        mentioned_subjects = self.subject_matcher.find(message_lower)
         
         if mentioned_subjects:
-            entities["subjects"] = mentioned_subjects
+            entities["subjects"] = tuple(mentioned_subjects)
             entities["primary_subject"] = mentioned_subjects[0]
         
+        difficulty_match = self.difficulty_pattern.search(message_lower)
+        if difficulty_match:
+            entities["difficulty"] = difficulty_match.lastgroup
+        
         return entities
 
 class AIIntentLoader:
     """Lazy loader for the Groq Intent Classifier to handle dependencies."""
     _instance = None
+    _lock = threading.Lock()
     
     def __new__(cls):
         if cls._instance is None:
-            try:
-                cls._instance = GroqIntentClassifier()
-            except Exception as e:
-                logger.warning(f"Failed to initialize Groq Intent Classifier: {str(e)}")
-                logger.warning("Falling back to SimpleIntentClassifier")
-                cls._instance = SimpleIntentClassifier()
+            with cls._lock:
+                if cls._instance is None:
+                    try:
+                        cls._instance = GroqIntentClassifier()
+                    except Exception as e:
+                        logger.warning(f"Failed to initialize Groq Intent Classifier: {str(e)}")
+                        logger.warning("Falling back to SimpleIntentClassifier")
+                        cls._instance = SimpleIntentClassifier()
         return cls._instance
 
-# Create a singleton instance of the AI Intent Classifier
-ai_classifier = AIIntentLoader()
-
 class MessageProcessor:
     """Processes and routes incoming messages to the appropriate handler."""
     
     def __init__(self):
-        self.classifier = ai_classifier
-        logger.info("Message Processor initialized with AI Intent Classifier")
+        logger.info("Message Processor initialized; intent classifier loads on first use")
+    
+    @cached_property
+    def classifier(self):
+        """The shared intent classifier, built on first access rather than at import."""
+        return AIIntentLoader()
+    
+    @cached_property
+    def classifier_is_async(self) -> bool:
+        """Whether the classifier is the async Groq one or the sync Simple one (fixed once loaded)."""
+        return asyncio.iscoroutinefunction(self.classifier.detect_intent)
     
     async def detect_intent(self, message: str) -> Tuple[str, Dict[str, Any]]:
         """
@@ -333,9 +440,9 @@ class MessageProcessor:
         Returns:
             A tuple of (intent_type, intent_data)
         """
-        # Use the AI classifier to detect intent
-        # Check if it's the async Groq classifier or sync Simple classifier
-        if hasattr(self.classifier, 'detect_intent') and asyncio.iscoroutinefunction(self.classifier.detect_intent):
+        # Use the AI classifier to detect intent. Both classifiers memoize
+        # results for repeated messages, so only the dispatch happens here.
+        if self.classifier_is_async:
             result = await self.classifier.detect_intent(message)
         else:
             result = self.classifier.detect_intent(message)
@@ -362,8 +469,6 @@ class MessageProcessor:
             A default response message, or None if no default exists
         """
         return self.classifier.get_default_response(intent)
-# Create a singleton instance of the MessageProcessor
-message_processor = MessageProcessor()
 
 # Create a singleton instance of the MessageProcessor
 message_processor = MessageProcessor()
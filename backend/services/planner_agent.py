@@ -2,53 +2,172 @@
 Planner Agent for creating and managing study plans for UPSC preparation.
 Helps users organize their study schedule and track progress.
 """
+import asyncio
 import logging
-import json
+import re
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
+from types import MappingProxyType
 from typing import Dict, List, Any, Optional, Tuple
 
 from .base_agent import BaseAgent
+from .onboarding_service import SPECIFIC_SUBJECTS_PROMPT, parse_subjects, update_onboarding_data
 from ..config import settings
 from ..db.database import SessionLocal
 from ..db.models import User, StudyPlan, Quiz
+from ..utils import json_utils
+from ..utils.keyword_matcher import KeywordMatcher
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 import uuid
 
 logger = logging.getLogger(__name__)
 
+# Keyword -> planner intent, in the order intents are reported
+INTENT_KEYWORDS = {
+    **dict.fromkeys(["create", "make", "new", "generate"], "create"),
+    **dict.fromkeys(["view", "show", "see", "my plan"], "view"),
+    **dict.fromkeys(["update", "change", "modify"], "update"),
+    **dict.fromkeys(["progress", "status", "how am i doing"], "progress")
+}
+
+# Days of a weekly schedule, in display order
+DAYS = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
+# Duration and daily-hours patterns used by _parse_preferences
+WEEK_PATTERN = re.compile(r'(\d+)\s*week')
+HOUR_PATTERN = re.compile(r'(\d+)\s*hou?r')
+
+# Matcher is built once and shared by every PlannerAgent (subjects are parsed
+# with onboarding_service.parse_subjects)
+intent_matcher = KeywordMatcher(INTENT_KEYWORDS)
+
+# Onboarding questions asked before a new user's first plan (the follow-up
+# asking for specific subjects is shared with OnboardingService)
+ONBOARDING_WELCOME = """👋 *Welcome to MentoraAI!* 🎓
+
+I see this is your first study plan. Let me help you get started with a personalized plan!
+
+*Question 1 of 3:*
+
+1️⃣ Which exam are you preparing for?
+   A) Prelims 2025
+   B) Mains 2025
+   C) Both Prelims & Mains
+
+Reply with *1A*, *1B*, or *1C*"""
+
+STUDY_HOURS_QUESTION = """✅ Great choice!
+
+*Question 2 of 3:*
+
+2️⃣ How many hours can you study daily?
+   A) 2-3 hours
+   B) 4-5 hours
+   C) 6+ hours
+
+Reply with *2A*, *2B*, or *2C*"""
+
+SUBJECTS_QUESTION = """✅ Perfect!
+
+*Question 3 of 3:*
+
+3️⃣ Which subjects do you want to focus on?
+   A) All subjects (balanced approach)
+   B) Specific subjects (I'll ask which ones)
+   C) Let the AI decide based on my quiz performance
+
+Reply with *3A*, *3B*, or *3C*"""
+
+# Answer tables for each onboarding question: (accepted tokens, stored value),
+# checked in order against the uppercased reply
+EXAM_TYPE_CHOICES = (
+    (('1A', 'PRELIMS'), 'Prelims 2025'),
+    (('1B', 'MAINS'), 'Mains 2025'),
+    (('1C', 'BOTH'), 'Both Prelims & Mains')
+)
+STUDY_HOURS_CHOICES = (
+    (('2A',), 3),
+    (('2B',), 5),
+    (('2C',), 7)
+)
+FOCUS_PREFERENCE_CHOICES = (
+    (('3A',), 'all_subjects'),
+    (('3B',), 'specific_subjects'),
+    (('3C',), 'ai_decide')
+)
+
+# Focus areas for the preferences that don't ask for subjects
+# ('ai_decide' adapts later based on quiz performance)
+DEFAULT_FOCUS_AREAS = {
+    'all_subjects': ['General Studies', 'Current Affairs', 'Optional Subject'],
+    'ai_decide': ['General Studies']
+}
+
 class PlannerAgent(BaseAgent):
     """Agent responsible for creating and managing study plans for UPSC aspirants."""
     
+    # Sample UPSC syllabus topics (simplified), shared read-only by every instance
+    SYLLABUS = MappingProxyType({
+        "Prelims": {
+            "General Studies Paper I": (
+                "Indian History", "Indian and World Geography", 
+                "Indian Polity and Governance", "Economic and Social Development",
+                "Environmental Ecology", "General Science", "Current Events"
+            ),
+            "CSAT Paper II": (
+                "Comprehension", "Interpersonal Skills", "Logical Reasoning",
+                "Analytical Ability", "Decision Making", "General Mental Ability",
+                "Basic Numeracy", "Data Interpretation"
+            )
+        },
+        "Mains": {
+            "Essay": ("Essay Writing",),
+            "General Studies I": ("Indian Heritage and Culture", "History and Geography of the World"),
+            "General Studies II": ("Governance", "Constitution", "Polity", "Social Justice", "International Relations"),
+            "General Studies III": ("Technology", "Economic Development", "Biodiversity", "Security", "Disaster Management"),
+            "General Studies IV": ("Ethics", "Integrity", "Aptitude"),
+            "Optional Subject I": ("Chosen by the candidate",),
+            "Optional Subject II": ("Chosen by the candidate",)
+        },
+        "Interview": ("Personality Test",)
+    })
+    
+    # Lowercased syllabus names for preference matching: (paper_lower, paper, ((topic_lower, topic), ...))
+    SYLLABUS_LOWER = tuple(
+        (paper.lower(), paper, tuple((topic.lower(), topic) for topic in topics))
+        for paper, topics in SYLLABUS.items()
+    )
+    
+    # Messages shorter than the shortest paper/topic name cannot mention one
+    SYLLABUS_MIN_LENGTH = min(
+        len(name) for paper_lower, _, topics in SYLLABUS_LOWER
+        for name in (paper_lower, *(topic_lower for topic_lower, _ in topics))
+    )
+    
     def __init__(self):
         """Initialize the PlannerAgent with default settings."""
         super().__init__("PlannerAgent")
         self.default_study_hours = 3  # Default study hours per day
         
-        # Sample UPSC syllabus topics (simplified)
-        self.syllabus = {
-            "Prelims": {
-                "General Studies Paper I": [
-                    "Indian History", "Indian and World Geography", 
-                    "Indian Polity and Governance", "Economic and Social Development",
-                    "Environmental Ecology", "General Science", "Current Events"
-                ],
-                "CSAT Paper II": [
-                    "Comprehension", "Interpersonal Skills", "Logical Reasoning",
-                    "Analytical Ability", "Decision Making", "General Mental Ability",
-                    "Basic Numeracy", "Data Interpretation"
-                ]
-            },
-            "Mains": {
-                "Essay": ["Essay Writing"],
-                "General Studies I": ["Indian Heritage and Culture", "History and Geography of the World"],
-                "General Studies II": ["Governance", "Constitution", "Polity", "Social Justice", "International Relations"],
-                "General Studies III": ["Technology", "Economic Development", "Biodiversity", "Security", "Disaster Management"],
-                "General Studies IV": ["Ethics", "Integrity", "Aptitude"],
-                "Optional Subject I": ["Chosen by the candidate"],
-                "Optional Subject II": ["Chosen by the candidate"]
-            },
-            "Interview": ["Personality Test"]
+        # Active plans keyed by phone number, as (expiry, plan). The StudyPlan table
+        # is the source of truth; this is a bounded LRU in front of it. Other
+        # workers can replace or edit a plan, so entries expire after a short TTL
+        # and writes go to the database row only while it is still active.
+        self.study_plans: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.study_plans_size = 1024
+        self.study_plans_ttl = 60.0  # Seconds
+        # Handlers run in worker threads, so LRU reordering/eviction is locked
+        self.study_plans_lock = threading.Lock()
+        
+        # Onboarding step -> handler for the user's answer to that step's question
+        self.onboarding_handlers = {
+            'exam_type': self._onboard_exam_type,
+            'study_hours': self._onboard_study_hours,
+            'subjects': self._onboard_subjects,
+            'specific_subjects': self._onboard_specific_subjects
         }
     
     async def process_message(self, phone_number: str, message: str, context: Optional[Dict[str, Any]] = None) -> str:
@@ -67,14 +186,16 @@ class PlannerAgent(BaseAgent):
             # Parse the user's intent
             intent = self._parse_intent(message.lower())
             
+            # The handlers do blocking Session work, so they run in a worker thread
+            # instead of stalling other requests on the event loop
             if "create" in intent or "new" in intent:
-                return await self._create_study_plan(phone_number, message)
+                return await asyncio.to_thread(self._create_study_plan, phone_number, message)
             elif "view" in intent or "show" in intent or "current" in intent:
-                return await self._view_study_plan(phone_number)
+                return await asyncio.to_thread(self._view_study_plan, phone_number)
             elif "update" in intent or "change" in intent:
-                return await self._update_study_plan(phone_number, message)
+                return await asyncio.to_thread(self._update_study_plan, phone_number, message)
             elif "progress" in intent or "status" in intent:
-                return await self._get_study_progress(phone_number)
+                return await asyncio.to_thread(self._get_study_progress, phone_number)
             else:
                 return self._get_planner_help()
                 
@@ -82,26 +203,27 @@ class PlannerAgent(BaseAgent):
             logger.error(f"Error in PlannerAgent: {str(e)}", exc_info=True)
             return await self.handle_error(e)
     
-    async def _create_study_plan(self, phone_number: str, message: str) -> str:
+    def _create_study_plan(self, phone_number: str, message: str) -> str:
         """Create a new study plan based on user preferences with interactive onboarding for new users."""
         db: Session = SessionLocal()
         try:
             # Ensure user exists
             user = self._get_or_create_user(db, phone_number)
             
-            # Check if user has any existing plans (to determine if they're new)
-            existing_plans = db.query(StudyPlan).filter(StudyPlan.user_id == user.id).count()
-            
-            # If new user and not in onboarding, start onboarding
-            if existing_plans == 0 and not user.onboarding_step:
-                return await self._start_onboarding(db, user)
-            
-            # If user is in onboarding, process their response
+            # If user is in onboarding, process their response (no plan check needed)
             if user.onboarding_step and user.onboarding_step != 'completed':
-                return await self._process_onboarding_response(db, user, message)
+                return self._process_onboarding_response(db, user, message)
+            
+            # Users who never started onboarding are new if they have no plans yet
+            if not user.onboarding_step:
+                has_plan = db.query(
+                    db.query(StudyPlan).filter(StudyPlan.user_id == user.id).exists()
+                ).scalar()
+                if not has_plan:
+                    return self._start_onboarding(db, user)
             
             # Otherwise, create plan normally (existing user or onboarding completed)
-            return await self._create_plan_from_preferences(db, user, message)
+            return self._create_plan_from_preferences(db, user, message)
             
         except Exception as e:
             logger.error(f"Error creating study plan: {str(e)}", exc_info=True)
@@ -109,158 +231,80 @@ class PlannerAgent(BaseAgent):
         finally:
             db.close()
     
-    async def _start_onboarding(self, db: Session, user: User) -> str:
+    def _start_onboarding(self, db: Session, user: User) -> str:
         """Start the interactive onboarding flow for new users."""
         user.onboarding_step = 'exam_type'
         user.onboarding_data = {}
         db.commit()
         
-        return """👋 *Welcome to MentoraAI!* 🎓
-
-I see this is your first study plan. Let me help you get started with a personalized plan!
-
-*Question 1 of 3:*
-
-1️⃣ Which exam are you preparing for?
-   A) Prelims 2025
-   B) Mains 2025
-   C) Both Prelims & Mains
-
-Reply with *1A*, *1B*, or *1C*"""
+        return ONBOARDING_WELCOME
     
-    async def _process_onboarding_response(self, db: Session, user: User, message: str) -> str:
+    def _process_onboarding_response(self, db: Session, user: User, message: str) -> str:
         """Process user responses during onboarding."""
-        message = message.strip().upper()
-        
-        # Initialize onboarding_data if None
-        if user.onboarding_data is None:
-            user.onboarding_data = {}
-        
-        if user.onboarding_step == 'exam_type':
-            # Parse exam type response
-            if '1A' in message or 'PRELIMS' in message:
-                user.onboarding_data['exam_type'] = 'Prelims 2025'
-            elif '1B' in message or 'MAINS' in message:
-                user.onboarding_data['exam_type'] = 'Mains 2025'
-            elif '1C' in message or 'BOTH' in message:
-                user.onboarding_data['exam_type'] = 'Both Prelims & Mains'
-            else:
-                return "❌ Invalid response. Please reply with *1A*, *1B*, or *1C*"
-            
-            # Move to next step
-            user.onboarding_step = 'study_hours'
-            db.commit()
-            
-            return """✅ Great choice!
-
-*Question 2 of 3:*
-
-2️⃣ How many hours can you study daily?
-   A) 2-3 hours
-   B) 4-5 hours
-   C) 6+ hours
-
-Reply with *2A*, *2B*, or *2C*"""
+        handler = self.onboarding_handlers.get(user.onboarding_step)
+        if not handler:
+            return "Something went wrong. Please try again."
         
-        elif user.onboarding_step == 'study_hours':
-            # Parse study hours response
-            if '2A' in message:
-                user.onboarding_data['daily_hours'] = 3
-            elif '2B' in message:
-                user.onboarding_data['daily_hours'] = 5
-            elif '2C' in message:
-                user.onboarding_data['daily_hours'] = 7
-            else:
-                return "❌ Invalid response. Please reply with *2A*, *2B*, or *2C*"
-            
-            # Move to next step
-            user.onboarding_step = 'subjects'
-            db.commit()
-            
-            return """✅ Perfect!
-
-*Question 3 of 3:*
-
-3️⃣ Which subjects do you want to focus on?
-   A) All subjects (balanced approach)
-   B) Specific subjects (I'll ask which ones)
-   C) Let the AI decide based on my quiz performance
-
-Reply with *3A*, *3B*, or *3C*"""
+        return handler(db, user, message.strip().upper())
+    
+    def _onboard_exam_type(self, db: Session, user: User, message: str) -> str:
+        """Store the exam type answer and ask for daily study hours."""
+        exam_type = self._match_choice(EXAM_TYPE_CHOICES, message)
+        if not exam_type:
+            return "❌ Invalid response. Please reply with *1A*, *1B*, or *1C*"
         
-        elif user.onboarding_step == 'subjects':
-            # Parse subjects response
-            if '3A' in message:
-                user.onboarding_data['focus_preference'] = 'all_subjects'
-                user.onboarding_data['focus_areas'] = ['General Studies', 'Current Affairs', 'Optional Subject']
-            elif '3B' in message:
-                user.onboarding_step = 'specific_subjects'
-                db.commit()
-                return """✅ Got it!
-
-Please tell me which subjects you want to focus on. For example:
-- "Polity, History, Geography"
-- "Economics and Environment"
-- "All GS papers"
-
-Type your subjects:"""
-            elif '3C' in message:
-                user.onboarding_data['focus_preference'] = 'ai_decide'
-                user.onboarding_data['focus_areas'] = ['General Studies']  # Will adapt based on quiz performance
-            else:
-                return "❌ Invalid response. Please reply with *3A*, *3B*, or *3C*"
-            
-            # Complete onboarding and generate plan
-            user.onboarding_step = 'completed'
-            db.commit()
-            
-            return await self._generate_onboarding_plan(db, user)
+        update_onboarding_data(user, exam_type=exam_type)
+        user.onboarding_step = 'study_hours'
+        db.commit()
         
-        elif user.onboarding_step == 'specific_subjects':
-            # Parse specific subjects from free text
-            subjects = self._parse_subjects_from_text(message)
-            user.onboarding_data['focus_preference'] = 'specific_subjects'
-            user.onboarding_data['focus_areas'] = subjects
-            
-            # Complete onboarding and generate plan
-            user.onboarding_step = 'completed'
-            db.commit()
-            
-            return await self._generate_onboarding_plan(db, user)
+        return STUDY_HOURS_QUESTION
+    
+    def _onboard_study_hours(self, db: Session, user: User, message: str) -> str:
+        """Store the daily hours answer and ask for focus subjects."""
+        daily_hours = self._match_choice(STUDY_HOURS_CHOICES, message)
+        if not daily_hours:
+            return "❌ Invalid response. Please reply with *2A*, *2B*, or *2C*"
         
-        return "Something went wrong. Please try again."
+        update_onboarding_data(user, daily_hours=daily_hours)
+        user.onboarding_step = 'subjects'
+        db.commit()
+        
+        return SUBJECTS_QUESTION
     
-    def _parse_subjects_from_text(self, text: str) -> List[str]:
-        """Extract subject names from user's free text."""
-        text = text.lower()
-        
-        # Common UPSC subjects
-        subject_keywords = {
-            'polity': 'Indian Polity',
-            'history': 'Indian History',
-            'geography': 'Geography',
-            'economics': 'Economics',
-            'economy': 'Economics',
-            'environment': 'Environment & Ecology',
-            'ecology': 'Environment & Ecology',
-            'science': 'General Science',
-            'current affairs': 'Current Affairs',
-            'csat': 'CSAT',
-            'ethics': 'Ethics & Integrity',
-            'international relations': 'International Relations',
-            'ir': 'International Relations',
-            'governance': 'Governance'
-        }
+    def _onboard_subjects(self, db: Session, user: User, message: str) -> str:
+        """Store the focus preference, or ask which subjects when the user wants to pick."""
+        preference = self._match_choice(FOCUS_PREFERENCE_CHOICES, message)
+        if not preference:
+            return "❌ Invalid response. Please reply with *3A*, *3B*, or *3C*"
         
-        found_subjects = []
-        for keyword, subject in subject_keywords.items():
-            if keyword in text and subject not in found_subjects:
-                found_subjects.append(subject)
+        if preference == 'specific_subjects':
+            user.onboarding_step = 'specific_subjects'
+            db.commit()
+            return SPECIFIC_SUBJECTS_PROMPT
         
-        # If no subjects found, default to General Studies
-        return found_subjects if found_subjects else ['General Studies']
+        return self._finish_onboarding(db, user, preference, list(DEFAULT_FOCUS_AREAS[preference]))
+    
+    def _onboard_specific_subjects(self, db: Session, user: User, message: str) -> str:
+        """Parse specific subjects from free text and finish onboarding."""
+        subjects = parse_subjects(message)
+        return self._finish_onboarding(db, user, 'specific_subjects', subjects)
     
-    async def _generate_onboarding_plan(self, db: Session, user: User) -> str:
+    def _finish_onboarding(self, db: Session, user: User, preference: str, focus_areas: List[str]) -> str:
+        """Complete onboarding and generate the plan (committed together with the plan)."""
+        update_onboarding_data(user, focus_preference=preference, focus_areas=focus_areas)
+        user.onboarding_step = 'completed'
+        
+        return self._generate_onboarding_plan(db, user)
+    
+    @staticmethod
+    def _match_choice(choices: Tuple[Tuple[Tuple[str, ...], Any], ...], message: str) -> Any:
+        """Return the value of the first choice whose token appears in the reply, or None."""
+        for tokens, value in choices:
+            if any(token in message for token in tokens):
+                return value
+        return None
+    
+    def _generate_onboarding_plan(self, db: Session, user: User) -> str:
         """Generate study plan after onboarding is complete."""
         # Build preferences from onboarding data
         preferences = {
@@ -277,100 +321,95 @@ Type your subjects:"""
         # Create new StudyPlan record
         new_plan = StudyPlan(
             user_id=user.id,
-            title=f"Study Plan - {datetime.now().strftime('%Y-%m-%d')}",
-            description=json.dumps(study_plan_data),
+            title=f"Study Plan - {study_plan_data['start_date']}",  # Plans start today
+            description=json_utils.dumps(study_plan_data),
+            start_date=datetime.fromisoformat(study_plan_data["start_date"]),
+            end_date=datetime.fromisoformat(study_plan_data["end_date"]),
+            status='active'
+        )
+        db.add(new_plan)
+        db.commit()  # Also saves the completed onboarding step
+        self._uncache_plan(user.phone_number)
+        
+        # Format the response
+        parts = [
+            "🎉 *Your Personalized Study Plan is Ready!* 🎉\n\n",
+            f"🎯 *Exam Target:* {preferences['exam_type']}\n",
+            f"📅 *Duration:* {preferences['duration_weeks']} weeks\n",
+            f"⏰ *Daily Study Time:* {preferences['daily_hours']} hours\n",
+            f"📚 *Focus Areas:* {', '.join(preferences['focus_areas'])}\n\n",
+            "*Here's your study plan for Week 1:*\n\n"
+        ]
+        
+        # Add first week's schedule
+        for day, topics in study_plan_data["weekly_schedule"][0].items():
+            parts.append(f"*{day}:* {', '.join(topics[:2]) if topics else 'Rest'}\n")
+        
+        parts.append(
+            "\n💡 *Pro Tips:*\n"
+            "• Type 'view plan' to see your full schedule\n"
+            "• Take quizzes to help me identify your weak areas\n"
+            "• I'll automatically adjust your plan based on your performance!\n\n"
+            "Ready to start? Let's ace UPSC together! 💪"
+        )
+        
+        return "".join(parts)
+    
+    def _create_plan_from_preferences(self, db: Session, user: User, message: str) -> str:
+        """Create plan for existing users or after onboarding (the caller owns the session)."""
+        # Parse user preferences from message
+        preferences = self._parse_preferences(message)
+        
+        # Check for weak areas from Quizzes
+        weak_areas = self._get_weak_areas(db, user.id)
+        if weak_areas:
+            preferences["weak_areas"] = weak_areas
+            # Add weak areas to focus areas if not present (order-preserving merge)
+            preferences["focus_areas"] = list(dict.fromkeys(preferences["focus_areas"] + weak_areas))
+        
+        # Generate study plan
+        study_plan_data = self._generate_study_plan(preferences)
+        
+        # Deactivate old plans; archived in the same transaction as the insert below.
+        # No archived plan objects are used afterwards, so skip session syncing.
+        db.query(StudyPlan).filter(
+            StudyPlan.user_id == user.id, 
+            StudyPlan.status == 'active'
+        ).update({"status": "archived"}, synchronize_session=False)
+        
+        # Create new StudyPlan record
+        new_plan = StudyPlan(
+            user_id=user.id,
+            title=f"Study Plan - {study_plan_data['start_date']}",  # Plans start today
+            description=json_utils.dumps(study_plan_data), # Store full JSON in description for now or create a separate model
             start_date=datetime.fromisoformat(study_plan_data["start_date"]),
             end_date=datetime.fromisoformat(study_plan_data["end_date"]),
             status='active'
         )
         db.add(new_plan)
         db.commit()
+        self._uncache_plan(user.phone_number)
         
         # Format the response
-        response = "🎉 *Your Personalized Study Plan is Ready!* 🎉\n\n"
-        response += f"🎯 *Exam Target:* {preferences['exam_type']}\n"
-        response += f"📅 *Duration:* {preferences['duration_weeks']} weeks\n"
-        response += f"⏰ *Daily Study Time:* {preferences['daily_hours']} hours\n"
-        response += f"📚 *Focus Areas:* {', '.join(preferences['focus_areas'])}\n\n"
+        parts = [
+            "📚 *Your Study Plan Has Been Created!* 📚\n\n",
+            f"📅 *Duration:* {preferences['duration_weeks']} weeks\n",
+            f"⏰ *Daily Study Time:* {preferences['daily_hours']} hours\n",
+            f"🎯 *Focus Areas:* {', '.join(preferences['focus_areas'])}\n"
+        ]
+        
+        if weak_areas:
+            parts.append(f"⚠️ *Detected Weak Areas:* {', '.join(weak_areas)} (Prioritized in plan)\n")
         
-        response += "*Here's your study plan for Week 1:*\n\n"
+        parts.append("\nHere's your study plan for the first week:\n\n")
         
         # Add first week's schedule
         for day, topics in study_plan_data["weekly_schedule"][0].items():
-            response += f"*{day}:* {', '.join(topics[:2]) if topics else 'Rest'}\n"
+            parts.append(f"*{day}:* {', '.join(topics[:2])}\n")
         
-        response += "\n💡 *Pro Tips:*\n"
-        response += "• Type 'view plan' to see your full schedule\n"
-        response += "• Take quizzes to help me identify your weak areas\n"
-        response += "• I'll automatically adjust your plan based on your performance!\n\n"
-        response += "Ready to start? Let's ace UPSC together! 💪"
+        parts.append("\nType 'view plan' to see your full plan or 'progress' to update your progress.")
         
-        return response
-    
-    async def _create_plan_from_preferences(self, db: Session, user: User, message: str) -> str:
-        """Create plan for existing users or after onboarding."""
-        db: Session = SessionLocal()
-        try:
-            # Parse user preferences from message
-            preferences = self._parse_preferences(message)
-            
-            # Ensure user exists
-            user = self._get_or_create_user(db, phone_number)
-            
-            # Check for weak areas from Quizzes
-            weak_areas = self._get_weak_areas(db, user.id)
-            if weak_areas:
-                preferences["weak_areas"] = weak_areas
-                # Add weak areas to focus areas if not present
-                for area in weak_areas:
-                    if area not in preferences["focus_areas"]:
-                        preferences["focus_areas"].append(area)
-            
-            # Generate study plan
-            study_plan_data = self._generate_study_plan(preferences)
-            
-            # Deactivate old plans
-            db.query(StudyPlan).filter(
-                StudyPlan.user_id == user.id, 
-                StudyPlan.status == 'active'
-            ).update({"status": "archived"})
-            
-            # Create new StudyPlan record
-            new_plan = StudyPlan(
-                user_id=user.id,
-                title=f"Study Plan - {datetime.now().strftime('%Y-%m-%d')}",
-                description=json.dumps(study_plan_data), # Store full JSON in description for now or create a separate model
-                start_date=datetime.fromisoformat(study_plan_data["start_date"]),
-                end_date=datetime.fromisoformat(study_plan_data["end_date"]),
-                status='active'
-            )
-            db.add(new_plan)
-            db.commit()
-            
-            # Format the response
-            response = "📚 *Your Study Plan Has Been Created!* 📚\n\n"
-            response += f"📅 *Duration:* {preferences['duration_weeks']} weeks\n"
-            response += f"⏰ *Daily Study Time:* {preferences['daily_hours']} hours\n"
-            response += f"🎯 *Focus Areas:* {', '.join(preferences['focus_areas'])}\n"
-            
-            if weak_areas:
-                response += f"⚠️ *Detected Weak Areas:* {', '.join(weak_areas)} (Prioritized in plan)\n"
-            
-            response += "\nHere's your study plan for the first week:\n\n"
-            
-            # Add first week's schedule
-            for day, topics in study_plan_data["weekly_schedule"][0].items():
-                response += f"*{day}:* {', '.join(topics[:2])}\n"
-            
-            response += "\nType 'view plan' to see your full plan or 'progress' to update your progress."
-            
-            return response
-            
-        except Exception as e:
-            logger.error(f"Error creating study plan: {str(e)}", exc_info=True)
-            return "I couldn't create your study plan. Please try again with your preferences."
-        finally:
-            db.close()
+        return "".join(parts)
 
     def _get_or_create_user(self, db: Session, phone_number: str) -> User:
         """Get existing user or create a new one."""
@@ -395,61 +434,44 @@ Type your subjects:"""
         except Exception:
             return []
     
-    async def _view_study_plan(self, phone_number: str) -> str:
+    def _view_study_plan(self, phone_number: str) -> str:
         """View the user's current study plan."""
         db: Session = SessionLocal()
         try:
-            user = db.query(User).filter(User.phone_number == phone_number).first()
-            if not user:
-                return "You don't have an active study plan yet."
+            # Parsed plan from the LRU; the stored JSON is only decoded on a cache miss
+            plan = self._get_active_plan(db, phone_number)
             
-            plan_record = db.query(StudyPlan).filter(
-                StudyPlan.user_id == user.id,
-                StudyPlan.status == 'active'
-            ).first()
-            
-            if not plan_record:
+            if not plan:
                 return (
                     "You don't have an active study plan yet. "
                     "Would you like me to create one for you? "
                     "Just tell me your available study time and preferences."
                 )
             
-            # Load plan data from JSON description
-            plan_data = json.loads(plan_record.description)
-            # We don't have preferences stored separately in this simple model, 
-            # so we might need to extract them or store them better.
-            # For now, assume defaults or extract from plan_data if possible.
-            duration_weeks = len(plan_data.get("weekly_schedule", []))
+            plan_data = plan["plan"]
+            weekly_schedule = plan_data.get("weekly_schedule", [])
+            duration_weeks = len(weekly_schedule)
             
-            response = (
+            parts = [
                 "📋 *Your Study Plan* 📋\n\n"
                 f"📅 *Duration:* {duration_weeks} weeks\n"
-                f"📅 *Start Date:* {plan_record.start_date}\n"
-                f"📅 *End Date:* {plan_record.end_date}\n\n"
+                f"📅 *Start Date:* {plan_data['start_date']}\n"
+                f"📅 *End Date:* {plan_data['end_date']}\n\n"
                 "*This Week's Schedule:*\n"
-            )
+            ]
             
             # Get current week (0-indexed)
-            # We need to recalculate current week based on start_date
-            start_date = plan_record.start_date
-            if isinstance(start_date, str):
-                 start_date = datetime.fromisoformat(start_date).date()
-            
-            days_passed = (datetime.now().date() - start_date).days
-            current_week = max(0, days_passed // 7)
-            current_week = min(current_week, duration_weeks - 1)
+            current_week = min(self._get_current_week(plan), duration_weeks - 1)
             
             # Add current week's schedule
-            if current_week < len(plan_data["weekly_schedule"]):
-                for day, topics in plan_data["weekly_schedule"][current_week].items():
-                    response += f"\n*{day}:*\n"
-                    for i, topic in enumerate(topics, 1):
-                        response += f"  {i}. {topic}\n"
+            if 0 <= current_week < duration_weeks:
+                for day, topics in weekly_schedule[current_week].items():
+                    parts.append(f"\n*{day}:*\n")
+                    parts.extend(f"  {i}. {topic}\n" for i, topic in enumerate(topics, 1))
             
-            response += "\nType 'progress' to update your progress or 'update plan' to make changes."
+            parts.append("\nType 'progress' to update your progress or 'update plan' to make changes.")
             
-            return response
+            return "".join(parts)
             
         except Exception as e:
             logger.error(f"Error viewing study plan: {str(e)}", exc_info=True)
@@ -457,31 +479,60 @@ Type your subjects:"""
         finally:
             db.close()
     
-    async def _update_study_plan(self, phone_number: str, message: str) -> str:
+    def _update_study_plan(self, phone_number: str, message: str) -> str:
         """Update the user's study plan based on new preferences."""
+        db: Session = SessionLocal()
         try:
-            if phone_number not in self.study_plans:
+            # Writes start from the stored plan, not a possibly stale cached copy
+            plan = self._get_active_plan(db, phone_number, refresh=True)
+            if not plan:
                 return "You don't have an active study plan. Would you like to create one?"
             
             # Parse update preferences from message
             updates = self._parse_preferences(message)
             
-            # Update the plan
-            plan = self.study_plans[phone_number]
-            plan["preferences"].update(updates)
-            plan["plan"] = self._generate_study_plan(plan["preferences"])
-            plan["last_updated"] = datetime.now().isoformat()
+            # Build the updated plan as a new dict (other threads may be reading the
+            # cached one); start_date may have changed, so "_start_dt" is parsed again
+            preferences = {**plan["preferences"], **updates}
+            updated_plan = {
+                "id": plan["id"],
+                "preferences": preferences,
+                "_start_dt": self._parse_start_date(preferences.get("start_date")),
+                "plan": self._generate_study_plan(preferences),
+                "progress": plan["progress"],
+                "last_updated": datetime.now().isoformat()
+            }
             
+            # Only write to the plan while it is still active; another worker may
+            # have archived it for a new one since it was loaded
+            updated = db.query(StudyPlan).filter(
+                StudyPlan.id == plan["id"],
+                StudyPlan.status == 'active'
+            ).update({
+                "description": json_utils.dumps(updated_plan["plan"]),
+                "start_date": datetime.fromisoformat(updated_plan["plan"]["start_date"]),
+                "end_date": datetime.fromisoformat(updated_plan["plan"]["end_date"])
+            }, synchronize_session=False)
+            db.commit()
+            if not updated:
+                self._uncache_plan(phone_number)
+                return "Your study plan was just replaced. Type 'view plan' to see it, then try your update again."
+            
+            self._cache_plan(phone_number, updated_plan)
             return "✅ Your study plan has been updated! Type 'view plan' to see the changes."
             
         except Exception as e:
             logger.error(f"Error updating study plan: {str(e)}", exc_info=True)
+            self._uncache_plan(phone_number)
             return "I couldn't update your study plan. Please try again with your new preferences."
+        finally:
+            db.close()
     
-    async def _get_study_progress(self, phone_number: str) -> str:
+    def _get_study_progress(self, phone_number: str) -> str:
         """Get the user's study progress."""
+        db: Session = SessionLocal()
         try:
-            plan = self.study_plans.get(phone_number)
+            plan = self._get_active_plan(db, phone_number)
             if not plan:
                 return "You don't have an active study plan yet. Would you like to create one?"
             
@@ -493,46 +544,110 @@ Type your subjects:"""
             current_week = self._get_current_week(plan)
             
             # Calculate completion percentage
-            total_topics = sum(len(week[day]) for week in plan["plan"]["weekly_schedule"] for day in week)
+            total_topics = plan["plan"]["total_topics"]
             completed_topics = len(progress.get("completed_topics", []))
             completion_pct = (completed_topics / total_topics * 100) if total_topics > 0 else 0
             
-            response = (
+            parts = [
                 "📊 *Your Study Progress* 📊\n\n"
                 f"📅 *Week {current_week + 1} of {total_weeks}*\n"
                 f"✅ *Completed Topics:* {completed_topics} of {total_topics} ({completion_pct:.1f}%)\n\n"
-            )
+            ]
             
             # Add streak information if available
             if "current_streak" in progress:
-                response += f"🔥 *Current Streak:* {progress['current_streak']} days\n"
+                parts.append(f"🔥 *Current Streak:* {progress['current_streak']} days\n")
             
             # Add recent activity
             if "recent_activity" in progress and progress["recent_activity"]:
-                response += "\n*Recent Activity:*\n"
-                for activity in progress["recent_activity"][-3:]:  # Show last 3 activities
-                    response += f"- {activity}\n"
+                parts.append("\n*Recent Activity:*\n")
+                # Show last 3 activities
+                parts.extend(f"- {activity}\n" for activity in progress["recent_activity"][-3:])
             
-            response += "\nTo update your progress, type 'completed [topic]' or 'skipped [topic]'."
+            parts.append("\nTo update your progress, type 'completed [topic]' or 'skipped [topic]'.")
             
-            return response
+            return "".join(parts)
             
         except Exception as e:
             logger.error(f"Error getting study progress: {str(e)}", exc_info=True)
             return "I couldn't retrieve your study progress. Please try again later."
+        finally:
+            db.close()
+    
+    def _get_active_plan(self, db: Session, phone_number: str, refresh: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Return the user's active plan, loading it from the database on a cache miss.
+        
+        Cached plans are shared between threads and must not be mutated; build a
+        new dict and store it with _cache_plan instead. Pass refresh=True to
+        skip the cache, e.g. before writing to the plan.
+        """
+        if not refresh:
+            plan = self._get_cached_plan(phone_number)
+            if plan is not None:
+                return plan
+        
+        plan_record = db.query(StudyPlan).join(User, StudyPlan.user_id == User.id).filter(
+            User.phone_number == phone_number,
+            StudyPlan.status == 'active'
+        ).first()
+        if not plan_record:
+            self._uncache_plan(phone_number)
+            return None
+        
+        # Only the generated schedule is stored, so rebuild the preferences from it
+        plan_data = json_utils.loads(plan_record.description)
+        weekly_schedule = plan_data.get("weekly_schedule", [])
+        duration_weeks = len(weekly_schedule) or 12
+        if "total_topics" not in plan_data:  # Plans saved before the count was stored
+            plan_data["total_topics"] = sum(len(topics) for week in weekly_schedule for topics in week.values())
+        focus_areas = list(dict.fromkeys(
+            topic for day_topics in (weekly_schedule[0].values() if weekly_schedule else []) for topic in day_topics
+        ))
+        plan = {
+            "id": plan_record.id,
+            "preferences": {
+                "duration_weeks": duration_weeks,
+                "daily_hours": plan_data.get("total_hours", 0) // (duration_weeks * 7) or self.default_study_hours,
+                "focus_areas": focus_areas or ["General Studies"],
+                "start_date": plan_data.get("start_date")
+            },
+            "_start_dt": self._parse_start_date(plan_data.get("start_date")),  # Parsed once per load
+            "plan": plan_data,
+            "progress": {}
+        }
+        self._cache_plan(phone_number, plan)
+        return plan
+    
+    def _get_cached_plan(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a cached plan that has not expired, or None."""
+        with self.study_plans_lock:
+            entry = self.study_plans.get(key)
+            if entry is None:
+                return None
+            expires_at, plan = entry
+            if expires_at <= time.monotonic():
+                del self.study_plans[key]
+                return None
+            self.study_plans.move_to_end(key)
+            return plan
+    
+    def _cache_plan(self, key: str, plan: Dict[str, Any]) -> None:
+        """Store a plan in the in-memory LRU, evicting the least recently used one."""
+        with self.study_plans_lock:
+            self.study_plans[key] = (time.monotonic() + self.study_plans_ttl, plan)
+            self.study_plans.move_to_end(key)
+            if len(self.study_plans) > self.study_plans_size:
+                self.study_plans.popitem(last=False)
+    
+    def _uncache_plan(self, key: str) -> None:
+        """Drop a user's cached plan so the next read goes to the database."""
+        with self.study_plans_lock:
+            self.study_plans.pop(key, None)
     
     def _parse_intent(self, message: str) -> List[str]:
         """Parse the user's intent from their message."""
-        intents = []
-        
-        if any(word in message for word in ["create", "make", "new", "generate"]):
-            intents.append("create")
-        if any(word in message for word in ["view", "show", "see", "my plan"]):
-            intents.append("view")
-        if any(word in message for word in ["update", "change", "modify"]):
-            intents.append("update")
-        if any(word in message for word in ["progress", "status", "how am i doing"]):
-            intents.append("progress")
+        intents = intent_matcher.find(message)
         
         return intents if intents else ["help"]
     
@@ -549,8 +664,7 @@ Type your subjects:"""
         if "week" in message:
             try:
                 # Look for numbers followed by 'week' or 'weeks'
-                import re
-                week_match = re.search(r'(\d+)\s*week', message)
+                week_match = WEEK_PATTERN.search(message)
                 if week_match:
                     preferences["duration_weeks"] = min(int(week_match.group(1)), 52)  # Max 1 year
             except (ValueError, AttributeError):
@@ -560,21 +674,24 @@ Type your subjects:"""
         if any(word in message for word in ["hour", "hr", "hrs"]):
             try:
                 # Look for numbers followed by 'hour' or 'hours'
-                import re
-                hour_match = re.search(r'(\d+)\s*hou?r', message)
+                hour_match = HOUR_PATTERN.search(message)
                 if hour_match:
                     preferences["daily_hours"] = min(int(hour_match.group(1)), 12)  # Max 12 hours/day
             except (ValueError, AttributeError):
                 pass
         
         # Parse focus areas (simplified)
+        message_lower = message.lower()
+        if len(message_lower) < self.SYLLABUS_MIN_LENGTH:
+            return preferences
+        
         focus_areas = []
-        for paper, topics in self.syllabus.items():
-            if paper.lower() in message.lower():
+        for paper_lower, paper, topics in self.SYLLABUS_LOWER:
+            if paper_lower in message_lower:
                 focus_areas.append(paper)
             else:
-                for topic in topics:
-                    if topic.lower() in message.lower():
+                for topic_lower, topic in topics:
+                    if topic_lower in message_lower:
                         focus_areas.append(topic)
         
         if focus_areas:
@@ -584,71 +701,61 @@ Type your subjects:"""
     
     def _generate_study_plan(self, preferences: Dict[str, Any]) -> Dict[str, Any]:
         """Generate a study plan based on user preferences."""
+        # Simple implementation - in a real app, this would be more sophisticated
+        now = datetime.now()
+        duration_weeks = preferences.get("duration_weeks", 12)
+        daily_hours = preferences.get("daily_hours", 3)
+        focus_areas = preferences.get("focus_areas", ["General Studies"])
+        
+        # Every week starts from the same layout, so work it out once
+        week_plan = {day: [] for day in DAYS}
+        
+        # Distribute focus areas across the week
+        for i, area in enumerate(focus_areas):
+            week_plan[DAYS[i % len(DAYS)]].append(area)
+        
+        # Each week (and day list) is its own object so one week can be changed
+        # without touching the rest; the week number is the list index
+        weekly_schedule = [
+            {day: list(topics) for day, topics in week_plan.items()}
+            for _ in range(duration_weeks)
+        ]
+        
+        return {
+            "weekly_schedule": weekly_schedule,
+            "total_topics": len(focus_areas) * duration_weeks,  # Every area appears once per week
+            "total_hours": duration_weeks * 7 * daily_hours,
+            "start_date": preferences["start_date"] if "start_date" in preferences else now.date().isoformat(),
+            "end_date": (now + timedelta(weeks=duration_weeks)).date().isoformat()
+        }
+    
+    @staticmethod
+    def _parse_start_date(start_iso: Optional[str]) -> Optional[datetime]:
+        """Parse a plan's ISO start date, or return None if it is missing or invalid."""
+        if not start_iso:
+            return None
         try:
-            # Simple implementation - in a real app, this would be more sophisticated
-            duration_weeks = preferences.get("duration_weeks", 12)
-            daily_hours = preferences.get("daily_hours", 3)
-            focus_areas = preferences.get("focus_areas", ["General Studies"])
-            
-            # Generate weekly schedule
-            weekly_schedule = []
-            
-            # For each week
-            for week in range(duration_weeks):
-                week_plan = {
-                    "Monday": [],
-                    "Tuesday": [],
-                    "Wednesday": [],
-                    "Thursday": [],
-                    "Friday": [],
-                    "Saturday": [],
-                    "Sunday": []
-                }
-                
-                # Distribute focus areas across the week
-                for i, area in enumerate(focus_areas):
-                    day = list(week_plan.keys())[i % len(week_plan)]
-                    week_plan[day].append(area)
-                
-                weekly_schedule.append(week_plan)
-            
-            return {
-                "weekly_schedule": weekly_schedule,
-                "total_hours": duration_weeks * 7 * daily_hours,
-                "start_date": preferences.get("start_date", datetime.now().date().isoformat()),
-                "end_date": (datetime.now() + timedelta(weeks=duration_weeks)).date().isoformat()
-            }
-            
-        except Exception as e:
-            logger.error(f"Error generating study plan: {str(e)}", exc_info=True)
-            # Return a default plan in case of error
-            return {
-                "weekly_schedule": [{"Monday": ["General Studies"], "Tuesday": ["Current Affairs"], 
-                                  "Wednesday": ["Optional Subject"], "Thursday": ["Practice Tests"], 
-                                  "Friday": ["General Studies"], "Saturday": ["Revision"], 
-                                  "Sunday": ["Rest/Review"]}],
-                "total_hours": duration_weeks * 7 * 3,  # 3 hours/day default
-                "start_date": datetime.now().date().isoformat(),
-                "end_date": (datetime.now() + timedelta(weeks=12)).date().isoformat()
-            }
+            return datetime.fromisoformat(start_iso)
+        except (TypeError, ValueError):
+            logger.warning(f"Invalid plan start date: {start_iso!r}")
+            return None
     
     def _get_current_week(self, plan: Dict[str, Any]) -> int:
-        """Calculate the current week number in the study plan."""
-        try:
-            start_date = datetime.fromisoformat(plan["preferences"].get("start_date", datetime.now().isoformat()))
-            current_date = datetime.now()
-            
-            # Calculate weeks passed
-            days_passed = (current_date - start_date).days
-            weeks_passed = max(0, days_passed // 7)
-            
-            # Ensure we don't exceed total weeks
-            total_weeks = plan["preferences"].get("duration_weeks", 12)
-            return min(weeks_passed, total_weeks - 1)  # 0-based index
-            
-        except Exception as e:
-            logger.error(f"Error calculating current week: {str(e)}", exc_info=True)
-            return 0  # Default to first week
+        """Calculate the current week number in the study plan (read-only on the plan)."""
+        preferences = plan.get("preferences", {})
+        
+        # Parsed when the plan was loaded or updated, see _get_active_plan
+        start_date = plan.get("_start_dt")
+        if start_date is None:
+            return 0  # No valid start date recorded, treat as the first week
+        
+        # Calculate weeks passed
+        days_passed = (datetime.now() - start_date).days
+        weeks_passed = max(0, days_passed // 7)
+        
+        # Ensure we don't exceed total weeks
+        total_weeks = preferences.get("duration_weeks", 12)
+        return min(weeks_passed, total_weeks - 1)  # 0-based index
     
     def generate_weekly_plan(self, user_id: str) -> Dict[str, Any]:
         """
@@ -662,13 +769,13 @@ Type your subjects:"""
         """
         try:
             # Check if user has an existing plan
-            if user_id in self.study_plans:
-                plan = self.study_plans[user_id]
+            plan = self._get_cached_plan(user_id)
+            if plan is not None:
                 current_week = self._get_current_week(plan)
                 
                 # Get current week's schedule
-                weekly_schedule = plan.get("weekly_schedule", {})
-                current_week_plan = weekly_schedule.get(f"week_{current_week}", {})
+                weekly_schedule = plan["plan"].get("weekly_schedule", [])
+                current_week_plan = weekly_schedule[current_week] if current_week < len(weekly_schedule) else {}
                 
                 if current_week_plan:
                     return {
@@ -681,14 +788,14 @@ Type your subjects:"""
                 # If no specific week plan exists, return the general plan
                 return {
                     "status": "success",
-                    "plan": plan,
+                    "plan": plan["plan"],
                     "message": "Here's your study plan"
                 }
             
-            # If no plan exists, create a default one
+            # If no plan exists, create a default one. It is not saved, so it is
+            # not cached either (cached plans are persisted ones with a DB id).
             default_prefs = self._parse_preferences("")
             plan = self._generate_study_plan(default_prefs)
-            self.study_plans[user_id] = plan
             
             return {
                 "status": "success",
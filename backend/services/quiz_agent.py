@@ -6,6 +6,7 @@ import json
 import logging
 import re
 import random
+from collections import OrderedDict, deque
 from typing import Dict, List, Any, Optional, Tuple
 from datetime import datetime
 
@@ -13,12 +14,50 @@ from .base_agent import BaseAgent
 from .rag_service import RAGService
 from .llm_service import LLMService
 from ..db.database import SessionLocal
+from ..utils import json_utils
 from ..db.models import User, Quiz, QuizQuestion, UserResponse
 from sqlalchemy.orm import Session
 import uuid
 
 logger = logging.getLogger(__name__)
 
+# Patterns used to pull the JSON array out of an LLM response
+THINK_PATTERN = re.compile(r'<think>.*?</think>', re.IGNORECASE | re.DOTALL)
+FENCE_PATTERN = re.compile(r'```(?:json)?\s*(.*?)\s*```', re.DOTALL)
+TRAILING_COMMA_PATTERN = re.compile(r',\s*([}\]])')
+EMPTY_VALUE_PATTERN = re.compile(r'([\{\[,])\s*([\}\],])')
+QUOTED_STRING_PATTERN = re.compile(r'(["\'])([^"\']*)\1')
+JSON_DECODER = json.JSONDecoder()
+
+# Fixed instructions sent ahead of every quiz request. Keeping the system
+# message identical across calls lets the provider reuse its cached prompt prefix.
+QUIZ_SYSTEM_PROMPT = """You are an expert UPSC exam question setter. Generate ONLY a valid JSON array of multiple-choice questions. 
+
+CRITICAL REQUIREMENTS:
+1. Return ONLY a JSON array - no explanations, no markdown, no other text
+2. Each question must have exactly 4 options labeled A, B, C, D
+3. Answer must be exactly one letter: A, B, C, or D
+4. Use this EXACT format for each question:
+{
+  "question": "Your question here?",
+  "options": ["A. Option 1", "B. Option 2", "C. Option 3", "D. Option 4"],
+  "answer": "C"
+}
+
+Example:
+[
+  {
+    "question": "What is the capital of India?",
+    "options": ["A. Mumbai", "B. Kolkata", "C. New Delhi", "D. Chennai"],
+    "answer": "C"
+  }
+]"""
+QUIZ_SYSTEM_MESSAGE = {"role": "system", "content": QUIZ_SYSTEM_PROMPT}
+QUIZ_USER_PROMPT_TAIL = "Return ONLY the JSON array. No explanations, no markdown, no other text."
+
+# Number of finished quizzes kept in each user's progress history
+RECENT_QUIZZES_LIMIT = 10
+
 class QuizAgent(BaseAgent):
     """
     Enhanced Quiz Agent that handles quiz generation, delivery, and evaluation
@@ -30,8 +69,11 @@ class QuizAgent(BaseAgent):
         super().__init__("QuizAgent")
         self.rag = rag_service or RAGService()
         self.llm = llm_service or LLMService()
-        self.active_quizzes: Dict[str, Dict] = {}  # user_id -> quiz_data
-        self.user_progress: Dict[str, Dict] = {}  # user_id -> progress_data
+        # In-memory session state per user, kept as bounded LRUs
+        self.active_quizzes: "OrderedDict[str, Dict]" = OrderedDict()  # user_id -> quiz_data
+        self.user_progress: "OrderedDict[str, Dict]" = OrderedDict()  # user_id -> progress_data
+        self.active_quizzes_size = 10000
+        self.user_progress_size = 10000
         
         # Quiz configuration
         self.difficulty_levels = {
@@ -61,6 +103,7 @@ class QuizAgent(BaseAgent):
         try:
             # Check if this is an answer to an active quiz
             if user_id in self.active_quizzes:
+                self.active_quizzes.move_to_end(user_id)
                 return await self._handle_quiz_response(user_id, message)
             
             # Otherwise, start a new quiz
@@ -83,6 +126,8 @@ class QuizAgent(BaseAgent):
             if not questions:
                 return "I couldn't generate any questions on that topic. Please try another topic or ask me something else!"
             
+            start_time = datetime.utcnow().isoformat()
+            
             # Persist to Database
             db: Session = SessionLocal()
             try:
@@ -116,7 +161,7 @@ class QuizAgent(BaseAgent):
                 quiz_id = str(new_quiz.id)
                 
                 # Store the quiz state in memory with DB IDs
-                self.active_quizzes[user_id] = {
+                self._store_lru(self.active_quizzes, self.active_quizzes_size, user_id, {
                     "quiz_id": quiz_id,
                     "questions": questions,
                     "question_ids": [str(q.id) for q in db_questions],
@@ -125,22 +170,22 @@ class QuizAgent(BaseAgent):
                     "responses": [],
                     "topic": topic,
                     "difficulty": difficulty,
-                    "start_time": datetime.utcnow().isoformat()
-                }
+                    "start_time": start_time
+                })
                 
             except Exception as e:
                 db.rollback()
                 logger.error(f"Database error starting quiz: {str(e)}", exc_info=True)
                 # Fallback to memory-only if DB fails
-                self.active_quizzes[user_id] = {
+                self._store_lru(self.active_quizzes, self.active_quizzes_size, user_id, {
                     "questions": questions,
                     "current_question": 0,
                     "score": 0,
                     "responses": [],
                     "topic": topic,
                     "difficulty": difficulty,
-                    "start_time": datetime.utcnow().isoformat()
-                }
+                    "start_time": start_time
+                })
             finally:
                 db.close()
             
@@ -151,6 +196,44 @@ class QuizAgent(BaseAgent):
             logger.error(f"Error starting quiz session: {str(e)}", exc_info=True)
             return "I had trouble creating your quiz. Please try again with a different topic."
 
+    @staticmethod
+    def _find_json_array(text: str, start: int) -> str:
+        """
+        Return the bracket-balanced array that opens at text[start].
+        
+        Brackets inside double-quoted strings are ignored. If the array is never
+        closed, the rest of the text is returned.
+        """
+        depth = 0
+        in_string = False
+        escaped = False
+        for i in range(start, len(text)):
+            char = text[i]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == '\\':
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char == '[':
+                depth += 1
+            elif char == ']':
+                depth -= 1
+                if depth == 0:
+                    return text[start:i + 1]
+        return text[start:]
+
+    @staticmethod
+    def _store_lru(cache: OrderedDict, size: int, key: str, value: Dict) -> None:
+        """Store a value in a bounded LRU, evicting the least recently used entry."""
+        cache[key] = value
+        cache.move_to_end(key)
+        if len(cache) > size:
+            cache.popitem(last=False)
+
     def _get_or_create_user(self, db: Session, phone_number: str) -> User:
         """Get existing user or create a new one."""
         user = db.query(User).filter(User.phone_number == phone_number).first()
@@ -176,44 +259,19 @@ class QuizAgent(BaseAgent):
         try:
             # Get relevant context using RAG
             context_size = self.difficulty_levels.get(difficulty, {}).get("context_size", 3)
-            docs = self.rag.collection.query(
-                query_texts=[topic],
-                n_results=context_size
-            )
+            docs = await self.rag.aretrieve(topic, context_size)
             
-            context = "\n\n".join(sum(docs["documents"], [])) if docs and "documents" in docs else ""
-            
-            system_prompt = """You are an expert UPSC exam question setter. Generate ONLY a valid JSON array of multiple-choice questions. 
-
-CRITICAL REQUIREMENTS:
-1. Return ONLY a JSON array - no explanations, no markdown, no other text
-2. Each question must have exactly 4 options labeled A, B, C, D
-3. Answer must be exactly one letter: A, B, C, or D
-4. Use this EXACT format for each question:
-{
-  "question": "Your question here?",
-  "options": ["A. Option 1", "B. Option 2", "C. Option 3", "D. Option 4"],
-  "answer": "C"
-}
-
-Example:
-[
-  {
-    "question": "What is the capital of India?",
-    "options": ["A. Mumbai", "B. Kolkata", "C. New Delhi", "D. Chennai"],
-    "answer": "C"
-  }
-]"""
-            
-            user_prompt = f"""Create exactly {num_questions} UPSC-style multiple-choice questions based on this context:
-
-{context}
-
-Return ONLY the JSON array. No explanations, no markdown, no other text."""
+            # The documents are joined straight into the prompt, without
+            # building a separate context string first
+            user_prompt = "\n\n".join([
+                f"Create exactly {num_questions} UPSC-style multiple-choice questions based on this context:",
+                *(docs or [""]),
+                QUIZ_USER_PROMPT_TAIL
+            ])
             
             # Use chat completion format for better control
             messages = [
-                {"role": "system", "content": system_prompt},
+                QUIZ_SYSTEM_MESSAGE,
                 {"role": "user", "content": user_prompt}
             ]
             
@@ -224,7 +282,7 @@ Return ONLY the JSON array. No explanations, no markdown, no other text."""
                 result = self.llm.generate_text("""
                 Generate a JSON array of quiz questions based on the context. 
                 Return ONLY the JSON array with no other text or formatting.
-                Context: """ + context)
+                Context: """ + "\n\n".join(docs))
             
             try:
                 # Clean the response
@@ -237,58 +295,52 @@ Return ONLY the JSON array. No explanations, no markdown, no other text."""
                     raise ValueError(f"LLM service error: {result}")
                 
                 # Remove any thinking/explanation blocks
-                if '<think>' in result.lower() and '</think>' in result.lower():
-                    result = re.sub(r'(?is)<think>.*?<\/think>', '', result)
+                result = THINK_PATTERN.sub('', result)
                 
                 # Handle markdown code blocks
-                if '```json' in result:
-                    result = result.split('```json', 1)[1].split('```', 1)[0].strip()
-                elif '```' in result:
-                    result = result.split('```', 1)[1].rsplit('```', 1)[0].strip()
-                
-                # Find JSON array boundaries - be more lenient with whitespace
-                result = re.sub(r'^[^\[]*', '', result)  # Remove anything before first [
-                result = re.sub(r'[^\]]*$', '', result)  # Remove anything after last ]
-                result = result.strip()
+                fence_match = FENCE_PATTERN.search(result)
+                if fence_match:
+                    result = fence_match.group(1)
                 
-                if not result or result[0] != '[' or result[-1] != ']':
+                # Decode the first JSON array; anything after it is ignored
+                start = result.find('[')
+                if start == -1:
                     logger.error(f"No valid JSON array found. First 200 chars: {result[:200]}")
-                    # Try to extract JSON from the response
-                    json_match = re.search(r'\[.*\]', result, re.DOTALL)
-                    if json_match:
-                        result = json_match.group(0)
-                        logger.info(f"Extracted JSON from response: {result[:100]}...")
-                    else:
-                        raise ValueError("No valid JSON array found in response")
+                    raise ValueError("No valid JSON array found in response")
                 
-                # Try to parse the JSON
+                # Fast path: the array runs up to the last ']' (uses orjson when installed)
                 try:
-                    questions = json.loads(result)
-                except json.JSONDecodeError as e:
-                    # Try to fix common JSON issues
-                    logger.warning(f"Initial JSON parse failed, attempting to clean: {str(e)}")
-                    
-                    # Fix common issues
-                    fixed = result
-                    # Remove trailing commas
-                    fixed = re.sub(r',\s*([}\]])', r'\1', fixed)
-                    # Fix empty values
-                    fixed = re.sub(r'([\{\[,])\s*([\}\],])', r'\1null\2', fixed)
-                    # Fix unescaped quotes in strings
-                    fixed = re.sub(r'(["\'])([^"\']*)\1', r'"\2"', fixed)
-                    
-                    # Try parsing again
+                    questions = json_utils.loads(result[start:result.rfind(']') + 1])
+                except ValueError:
+                    questions = None
+                
+                if questions is None:
                     try:
-                        questions = json.loads(fixed)
-                    except json.JSONDecodeError as e2:
-                        logger.error(f"Failed to parse JSON after cleaning: {str(e2)}")
-                        logger.debug(f"Problematic JSON: {fixed[:500]}...")
-                        # Return a fallback question
-                        return [{
-                            "question": "Sorry, I had trouble generating quiz questions. Please try again with a different topic.",
-                            "options": ["A. OK", "B. Try again", "C. Different topic", "D. Skip"],
-                            "answer": "A"
-                        }]
+                        questions, _ = JSON_DECODER.raw_decode(result, start)
+                    except json.JSONDecodeError as e:
+                        # Try to fix common JSON issues
+                        logger.warning(f"Initial JSON parse failed, attempting to clean: {str(e)}")
+                        
+                        # Repair only the array itself, not any text after it
+                        # Remove trailing commas
+                        fixed = TRAILING_COMMA_PATTERN.sub(r'\1', self._find_json_array(result, start))
+                        # Fix empty values
+                        fixed = EMPTY_VALUE_PATTERN.sub(r'\1null\2', fixed)
+                        # Fix unescaped quotes in strings
+                        fixed = QUOTED_STRING_PATTERN.sub(r'"\2"', fixed)
+                        
+                        # Try parsing again
+                        try:
+                            questions, _ = JSON_DECODER.raw_decode(fixed)
+                        except json.JSONDecodeError as e2:
+                            logger.error(f"Failed to parse JSON after cleaning: {str(e2)}")
+                            logger.debug(f"Problematic JSON: {fixed[:500]}...")
+                            # Return a fallback question
+                            return [{
+                                "question": "Sorry, I had trouble generating quiz questions. Please try again with a different topic.",
+                                "options": ["A. OK", "B. Try again", "C. Different topic", "D. Skip"],
+                                "answer": "A"
+                            }]
                 
                 # Validate the structure
                 if not isinstance(questions, list):
@@ -317,10 +369,17 @@ Return ONLY the JSON array. No explanations, no markdown, no other text."""
                             logger.warning(f"Question {i} has invalid answer: {q.get('answer')}")
                             continue
                             
-                        # Clean up the question and options
+                        # Clean up the question and options; the parsed list is
+                        # reused when the LLM already returned clean strings
+                        question_text = q["question"]
+                        if type(question_text) is not str:
+                            question_text = str(question_text)
+                        options = q["options"]
+                        if not all(type(opt) is str and opt == opt.strip() for opt in options):
+                            options = [str(opt).strip() for opt in options]
                         clean_q = {
-                            "question": str(q["question"]).strip(),
-                            "options": [str(opt).strip() for opt in q["options"]],
+                            "question": question_text.strip(),
+                            "options": options,
                             "answer": answer
                         }
                         
@@ -375,6 +434,7 @@ Return ONLY the JSON array. No explanations, no markdown, no other text."""
         if user_id not in self.active_quizzes:
             return "You don't have an active quiz. Start a new one with '/quiz <topic>'"
             
+        self.active_quizzes.move_to_end(user_id)
         quiz = self.active_quizzes[user_id]
         current_q = quiz["current_question"]
         questions = quiz["questions"]
@@ -383,6 +443,7 @@ Return ONLY the JSON array. No explanations, no markdown, no other text."""
             return await self._finalize_quiz(user_id)
             
         # Process the answer
+        now = datetime.utcnow()
         question = questions[current_q]
         is_correct = answer.strip().upper() == question["answer"].strip().upper()
         
@@ -412,7 +473,7 @@ Return ONLY the JSON array. No explanations, no markdown, no other text."""
                     quiz_record.score = quiz["score"]
                     if quiz["current_question"] + 1 >= len(questions):
                         quiz_record.completed = True
-                        quiz_record.completed_at = datetime.utcnow()
+                        quiz_record.completed_at = now
                 
                 db.commit()
             except Exception as e:
@@ -424,7 +485,7 @@ Return ONLY the JSON array. No explanations, no markdown, no other text."""
             "question_idx": current_q,
             "answer": answer,
             "is_correct": is_correct,
-            "timestamp": datetime.utcnow().isoformat()
+            "timestamp": now.isoformat()
         })
         
         # Move to next question
@@ -469,9 +530,16 @@ Return ONLY the JSON array. No explanations, no markdown, no other text."""
             
         question = quiz["questions"][current_q]
         
-        # Format question with options
-        options = "\n".join([f"{chr(65+i)}. {opt}" for i, opt in enumerate(question["options"])])
-        return f"Question {current_q + 1} of {len(quiz['questions'])}:\n\n{question['question']}\n\n{options}\n\nYour answer (A/B/C/D):"
+        # Questions don't change during a quiz, so the text is built once and
+        # reused when it is shown again (e.g. after a hint). It is kept on the
+        # session, keyed by question index, so the question dicts stay untouched.
+        displays = quiz.setdefault("displays", {})
+        display = displays.get(current_q)
+        if display is None:
+            options = "\n".join([f"{chr(65+i)}. {opt}" for i, opt in enumerate(question["options"])])
+            display = f"Question {current_q + 1} of {len(quiz['questions'])}:\n\n{question['question']}\n\n{options}\n\nYour answer (A/B/C/D):"
+            displays[current_q] = display
+        return display
     
     def _get_hint(self, user_id: str) -> str:
         """Provide a hint for the current question."""
@@ -563,25 +631,19 @@ Return ONLY the JSON array. No explanations, no markdown, no other text."""
         responses: List[Dict]
     ) -> None:
         """Update the user's progress based on quiz results."""
-        if user_id not in self.user_progress:
-            self.user_progress[user_id] = {
+        user_data = self.user_progress.get(user_id)
+        if user_data is None:
+            user_data = {
                 "quizzes_taken": 0,
                 "average_score": 0,
                 "topics": {},
-                "recent_quizzes": []
+                "recent_quizzes": deque(maxlen=RECENT_QUIZZES_LIMIT)
             }
-        
-        user_data = self.user_progress[user_id]
+        self._store_lru(self.user_progress, self.user_progress_size, user_id, user_data)
         
         # Update overall stats
-        total_quizzes = user_data["quizzes_taken"]
-        current_avg = user_data["average_score"]
-        
         user_data["quizzes_taken"] += 1
-        user_data["average_score"] = (
-            (current_avg * total_quizzes + score) / 
-            (total_quizzes + 1)
-        )
+        user_data["average_score"] += (score - user_data["average_score"]) / user_data["quizzes_taken"]
         
         # Update topic stats
         if topic not in user_data["topics"]:
@@ -592,42 +654,40 @@ Return ONLY the JSON array. No explanations, no markdown, no other text."""
             }
         
         topic_data = user_data["topics"][topic]
-        topic_quizzes = topic_data["quizzes_taken"]
-        topic_avg = topic_data["average_score"]
-        
         topic_data["quizzes_taken"] += 1
-        topic_data["average_score"] = (
-            (topic_avg * topic_quizzes + score) / 
-            (topic_quizzes + 1)
-        )
-        topic_data["last_attempted"] = datetime.utcnow().isoformat()
+        topic_data["average_score"] += (score - topic_data["average_score"]) / topic_data["quizzes_taken"]
+        finished_at = datetime.utcnow().isoformat()
+        topic_data["last_attempted"] = finished_at
         
-        # Add to recent quizzes (keep last 10)
+        # Add to recent quizzes (the deque drops the oldest past the limit)
         user_data["recent_quizzes"].append({
             "topic": topic,
             "score": score,
             "difficulty": difficulty,
-            "timestamp": datetime.utcnow().isoformat(),
+            "timestamp": finished_at,
             "responses": responses
         })
-        user_data["recent_quizzes"] = user_data["recent_quizzes"][-10:]
 
     def get_user_progress(self, user_id: str) -> Dict[str, Any]:
         """Get the quiz progress for a specific user."""
-        return self.user_progress.get(user_id, {
-            "quizzes_taken": 0,
-            "average_score": 0,
-            "topics": {},
-            "recent_quizzes": []
-        })
+        user_data = self.user_progress.get(user_id)
+        if user_data is None:
+            return {
+                "quizzes_taken": 0,
+                "average_score": 0,
+                "topics": {},
+                "recent_quizzes": []
+            }
+        return {**user_data, "recent_quizzes": list(user_data["recent_quizzes"])}
 
-    def evaluate_quiz(self, questions: List[Dict], user_answers: List[str]) -> Dict[str, Any]:
+    def evaluate_quiz(self, questions: List[Dict], user_answers: List[str], include_details: bool = True) -> Dict[str, Any]:
         """
         Evaluate a set of quiz answers against the correct answers.
         
         Args:
             questions: List of question dictionaries with 'answer' key
             user_answers: List of user answers (A, B, C, or D)
+            include_details: Whether to include the per-question breakdown
             
         Returns:
             Dictionary with evaluation results
@@ -639,22 +699,21 @@ Return ONLY the JSON array. No explanations, no markdown, no other text."""
                 "total": 0,
                 "details": []
             }
-            
+        
         details = []
         correct = 0
-        
         for i, (q, user_ans) in enumerate(zip(questions, user_answers)):
             is_correct = (user_ans or "").strip().upper() == q.get("answer", "").strip().upper()
             if is_correct:
                 correct += 1
-                
-            details.append({
-                "question_idx": i,
-                "question": q.get("question", ""),
-                "user_answer": user_ans,
-                "correct_answer": q.get("answer", ""),
-                "is_correct": is_correct
-            })
+            if include_details:
+                details.append({
+                    "question_idx": i,
+                    "question": q.get("question", ""),
+                    "user_answer": user_ans,
+                    "correct_answer": q.get("answer", ""),
+                    "is_correct": is_correct
+                })
         
         total = len(questions)
         score_pct = round((correct / total) * 100, 2) if total > 0 else 0
@@ -1,28 +1,231 @@
 import os
 import re
+import asyncio
+import hashlib
 import logging
+import threading
+from collections import OrderedDict, deque
 import chromadb
 from chromadb.config import Settings
-from typing import Optional
+from chromadb.utils import embedding_functions
+from typing import Any, Dict, List, Optional, Tuple
 from backend.services.llm_service import LLMService
+from backend.config import settings
+from backend.utils.semantic_cache import SemanticCache
+from backend.utils.vector_store import NCERT_COLLECTION, ncert_collection_metadata
 
 logger = logging.getLogger(__name__)
 
+# Patterns used by _clean_response
+THINK_PATTERN = re.compile(r'<think>.*?</think>', re.DOTALL)
+TAG_PATTERN = re.compile(r'<[^>]+>')
+BLANK_LINES_PATTERN = re.compile(r'\n\s*\n')
+
 class RAGService:
-    def __init__(self):
+    _instance = None
+    _lock = threading.Lock()
+    
+    def __new__(cls, llm_service: Optional[LLMService] = None):
+        """Share one instance so the Chroma client and caches are opened once per process."""
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super().__new__(cls)
+                    cls._instance._initialized = False
+        return cls._instance
+    
+    def __init__(self, llm_service: Optional[LLMService] = None):
+        if self._initialized:
+            return
+        
         # Ensure the data directory exists
         os.makedirs("./data/chroma", exist_ok=True)
         
         # Initialize Chroma client with persistent storage
         self.client = chromadb.PersistentClient(path="./data/chroma")
         
-        # Get or create the collection
+        # Embed queries with the same sentence-transformers model the corpus was
+        # ingested with; the model is loaded once here and picks the GPU when available.
+        # It is not attached to the collection (ingestion stores precomputed
+        # embeddings), so queries are always sent as embeddings.
+        self.embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
+            model_name=settings.EMBEDDING_MODEL
+        )
+        
+        # Get or create the collection. The metadata only takes effect when the
+        # collection is created (normally by ingestion/ncert_ingest.py).
         self.collection = self.client.get_or_create_collection(
-            name="ncert_corpus",
-            metadata={"hnsw:space": "cosine"}  # Use cosine similarity for text
+            name=NCERT_COLLECTION,
+            metadata=ncert_collection_metadata()
         )
+        stored_metadata = self.collection.metadata or {}
+        
+        # search_ef is a query-time setting, so keep an existing index in step with it.
+        # Only that key is sent: Chroma rejects a modify that includes hnsw:space.
+        if stored_metadata.get("hnsw:search_ef") != settings.HNSW_SEARCH_EF:
+            try:
+                self.collection.modify(metadata={"hnsw:search_ef": settings.HNSW_SEARCH_EF})
+            except Exception as e:
+                logger.warning(f"Could not apply HNSW_SEARCH_EF to {NCERT_COLLECTION}: {e}")
         
-        self.llm = LLMService()
+        # Changing EMBEDDING_MODEL requires re-running ingestion/ncert_ingest.py into
+        # a fresh collection; report a mismatch rather than failing at startup
+        ingested_with = stored_metadata.get("embedding_model")
+        if ingested_with and ingested_with != settings.EMBEDDING_MODEL:
+            logger.error(
+                f"{NCERT_COLLECTION} was ingested with {ingested_with!r} but EMBEDDING_MODEL is "
+                f"{settings.EMBEDDING_MODEL!r}; retrieval will be unreliable until the corpus is re-ingested "
+                "(delete the collection, then run python ingestion/ncert_ingest.py)"
+            )
+        
+        self.llm = llm_service or LLMService()
+
+        # Retrieved documents keyed on (normalized query, n_results) and
+        # generated answers keyed on a hash of the query and its context (bounded LRUs)
+        self.query_cache: "OrderedDict[Tuple[str, int], List[str]]" = OrderedDict()
+        self.answer_cache: "OrderedDict[str, str]" = OrderedDict()
+        self.cache_size = 512
+        self.cache_lock = threading.Lock()
+        # Answers reused for differently worded but equivalent questions
+        # (same retrieved context, near-identical embedding, same numbers/names)
+        self.semantic_cache = SemanticCache(size=512, threshold=0.97)
+
+        # Lookups from concurrent requests are sent to Chroma as one batched query.
+        # The service is shared by every event loop in the process, so queues and
+        # flush tasks are kept per loop; entries are removed once a queue drains.
+        self.pending_queries: "Dict[asyncio.AbstractEventLoop, deque]" = {}
+        self.batch_tasks: "Dict[asyncio.AbstractEventLoop, asyncio.Task]" = {}
+        self.batch_window = 0.01  # Extra wait to collect a burst of lookups
+        
+        self._initialized = True
+
+    def _cache_get(self, cache: OrderedDict, key):
+        """Return a cached value and mark it as recently used, or None on a miss."""
+        with self.cache_lock:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+            return value
+
+    def _cache_put(self, cache: OrderedDict, key, value) -> None:
+        """Store a value, evicting the least recently used entry when full."""
+        with self.cache_lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
+
+    def retrieve(self, query: str, n_results: int = 3, query_embedding: Optional[Any] = None) -> List[str]:
+        """
+        Return the documents most relevant to a query, reusing earlier lookups.
+        
+        Args:
+            query: The text to search for
+            n_results: Number of documents to retrieve
+            query_embedding: The query's embedding, if the caller already computed it
+            
+        Returns:
+            The matching documents, best match first
+        """
+        key = (query.strip().lower(), n_results)
+        docs = self._cache_get(self.query_cache, key)
+        if docs is not None:
+            return docs
+        
+        if query_embedding is None:
+            query_embedding = self.embedding_function([query])[0]
+        results = self.collection.query(
+            query_embeddings=[query_embedding],
+            n_results=n_results
+        )
+        docs = results['documents'][0] if results and results.get('documents') else []
+        self._cache_put(self.query_cache, key, docs)
+        return docs
+
+    async def aretrieve(self, query: str, n_results: int = 3) -> List[str]:
+        """
+        Async version of retrieve that batches concurrent lookups into one Chroma query.
+        
+        Args:
+            query: The text to search for
+            n_results: Number of documents to retrieve
+            
+        Returns:
+            The matching documents, best match first
+        """
+        key = (query.strip().lower(), n_results)
+        docs = self._cache_get(self.query_cache, key)
+        if docs is not None:
+            return docs
+        
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self.pending_queries.get(loop)
+        if pending is None:
+            pending = self.pending_queries[loop] = deque()
+            self.batch_tasks[loop] = loop.create_task(self._flush_loop(loop, pending))
+        pending.append((query, n_results, future))
+        return await future
+
+    async def _flush_loop(self, loop: asyncio.AbstractEventLoop, pending: deque) -> None:
+        """Send one loop's queued lookups to Chroma in batches until its queue is empty."""
+        try:
+            while pending:
+                # A lone lookup goes out straight away. Lookups that arrive while a
+                # batch is in flight queue up and are sent together next round.
+                if len(pending) > 1:
+                    await asyncio.sleep(self.batch_window)
+                await self._flush_batch(pending)
+        finally:
+            # Nothing can be queued between the emptiness check and here
+            del self.pending_queries[loop]
+            del self.batch_tasks[loop]
+            for _, _, future in pending:  # Only left over if the task was cancelled
+                future.cancel()
+
+    async def _flush_batch(self, pending: deque) -> None:
+        """Look up everything currently queued and resolve the waiting futures."""
+        # Group by n_results, since Chroma takes a single value per call
+        groups = {}
+        while pending:
+            query, n_results, future = pending.popleft()
+            groups.setdefault(n_results, []).append((query, future))
+        
+        try:
+            for n_results, items in groups.items():
+                # Queries that normalize to the same cache key share one row
+                queries = {}
+                for query, _ in items:
+                    queries.setdefault(query.strip().lower(), query)
+                try:
+                    results = await asyncio.to_thread(self._query_texts, list(queries.values()), n_results)
+                    rows = (results.get('documents') or []) if results else []
+                except Exception as e:
+                    for _, future in items:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                
+                found = {}
+                for i, normalized in enumerate(queries):
+                    found[normalized] = rows[i] if i < len(rows) else []
+                    self._cache_put(self.query_cache, (normalized, n_results), found[normalized])
+                for query, future in items:
+                    if not future.done():
+                        future.set_result(found[query.strip().lower()])
+        except asyncio.CancelledError:
+            # Don't leave callers waiting on lookups that were already dequeued
+            for items in groups.values():
+                for _, future in items:
+                    future.cancel()
+            raise
+
+    def _query_texts(self, texts: List[str], n_results: int) -> Any:
+        """Embed several queries and look them up in one Chroma call (blocking)."""
+        return self.collection.query(
+            query_embeddings=self.embedding_function(texts),
+            n_results=n_results
+        )
 
     def _clean_response(self, text: str) -> str:
         """Remove any internal thinking tags and clean up the response."""
@@ -30,17 +233,20 @@ class RAGService:
             return "I couldn't generate a response. Please try again."
             
         # Remove <think>...</think> blocks
-        text = re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL)
+        text = THINK_PATTERN.sub('', text)
         # Remove any remaining tags
-        text = re.sub(r'<[^>]+>', '', text)
+        text = TAG_PATTERN.sub('', text)
         # Clean up excessive newlines and whitespace
-        text = re.sub(r'\n\s*\n', '\n\n', text).strip()
+        text = BLANK_LINES_PATTERN.sub('\n\n', text).strip()
         return text or "I couldn't generate a proper response. Could you rephrase your question?"
 
     def retrieve_and_generate(self, query: str) -> str:
         """
         Retrieve relevant context and generate a response using the LLM.
         
+        Blocking (embedding, Chroma and the LLM call); async callers should run
+        it with asyncio.to_thread.
+        
         Args:
             query: The user's question
             
@@ -48,17 +254,31 @@ class RAGService:
             A clean, formatted response based on the retrieved context
         """
         try:
-            # Query the collection
-            results = self.collection.query(
-                query_texts=[query],
-                n_results=3
-            )
+            query_embedding = None
+            docs = self._cache_get(self.query_cache, (query.strip().lower(), 3))
+            if docs is None:
+                query_embedding = self.embedding_function([query])[0]
+                docs = self.retrieve(query, 3, query_embedding)
             
-            # Extract documents from results
-            if 'documents' in results and results['documents'] and len(results['documents']) > 0:
-                docs = results['documents'][0]  # Get the first (and only) query result
+            if docs:
                 context = "\n".join(docs)
                 
+                answer_key = hashlib.sha1(f"{query}|{context}".encode()).hexdigest()
+                answer = self._cache_get(self.answer_cache, answer_key)
+                if answer is not None:
+                    logger.info("RAG answer cache hit")
+                    return answer
+                
+                # A new wording may still match a question that was already
+                # answered from the same study material
+                context_key = hashlib.sha1(context.encode()).hexdigest()
+                if query_embedding is None:
+                    query_embedding = self.embedding_function([query])[0]
+                answer = self.semantic_cache.lookup(query_embedding, query, context_key)
+                if answer is not None:
+                    logger.info("RAG semantic cache hit")
+                    return answer
+                
                 prompt = f"""You are a helpful UPSC tutor. Use the following study material to answer the question clearly and concisely.
                 If the question is not related to the study material, politely explain that you can only answer UPSC-related questions.
 
@@ -70,7 +290,12 @@ class RAGService:
                 Answer concisely and directly, without any thinking process or internal dialogue:"""
                 
                 response = self.llm.generate_text(prompt)
-                return self._clean_response(response)
+                answer = self._clean_response(response)
+                # Don't keep API failures around
+                if response and not response.startswith("Error:"):
+                    self._cache_put(self.answer_cache, answer_key, answer)
+                    self.semantic_cache.add(query_embedding, query, context_key, answer)
+                return answer
             else:
                 return "I couldn't find any relevant information to answer that question in the study materials."
                 
@@ -28,6 +28,25 @@ class TelegramService:
         self.headers = {
             "Content-Type": "application/json"
         }
+        # Shared client so connections to the Bot API are kept alive between
+        # requests; created on first use inside the running event loop
+        self.client: Optional[httpx.AsyncClient] = None
+    
+    def _get_client(self) -> httpx.AsyncClient:
+        """Return the shared HTTP client, creating it if needed."""
+        if self.client is None or self.client.is_closed:
+            self.client = httpx.AsyncClient(
+                headers=self.headers,
+                timeout=httpx.Timeout(30.0, connect=5.0),
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+            )
+        return self.client
+    
+    async def aclose(self) -> None:
+        """Close the shared HTTP client (called on application shutdown)."""
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
     
     async def send_message(
         self, 
@@ -112,17 +131,14 @@ class TelegramService:
             HTTPException: If the request fails
         """
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.request(
-                    method,
-                    url,
-                    headers=self.headers,
-                    json=payload,
-                    timeout=30.0
-                )
-                
-                response.raise_for_status()
-                return response.json()
+            response = await self._get_client().request(
+                method,
+                url,
+                json=payload
+            )
+            
+            response.raise_for_status()
+            return response.json()
                 
         except httpx.HTTPStatusError as e:
             error_msg = f"HTTP error from Telegram API: {str(e)}"
@@ -3,6 +3,7 @@ Tracker Agent for monitoring and analyzing study progress and performance.
 Helps users track their UPSC preparation metrics and provides insights.
 """
 import logging
+import re
 from datetime import datetime, timedelta
 from typing import Dict, List, Any, Optional, Tuple
 import json
@@ -11,12 +12,40 @@ from .base_agent import BaseAgent
 from ..config import settings
 from ..db.database import SessionLocal
 from ..db.models import User, StudySession, ProgressTracking
+from ..utils.keyword_matcher import KeywordMatcher
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import and_, case, extract, func
 import uuid
 
 logger = logging.getLogger(__name__)
 
+# Keyword -> tracker intent, in the order intents are reported
+INTENT_KEYWORDS = {
+    **dict.fromkeys(["log", "add", "studied", "completed"], "log"),
+    **dict.fromkeys(["view", "show", "my progress", "my stats"], "view"),
+    **dict.fromkeys(["analytics", "stats", "insights"], "analytics"),
+    **dict.fromkeys(["goal", "target", "objective"], "goal")
+}
+
+# Built once and shared by every TrackerAgent
+intent_matcher = KeywordMatcher(INTENT_KEYWORDS)
+
+# Goal target/progress amount and goal name patterns used by _manage_goals
+NUMBER_PATTERN = re.compile(r'(\d+)')
+GOAL_NAME_PATTERN = re.compile(r'goal (?:to|for) (.+?) (?:for|in)')
+
+# Session duration, topic and notes patterns used by _parse_session_data
+MINUTES_PATTERN = re.compile(r'(\d+)\s*(?:min|minutes|mins|m)\b')
+HOURS_PATTERN = re.compile(r'(\d+)\s*(?:hr|hour|hours|h)\b')
+TOPIC_PATTERN = re.compile(r'(?:studied|completed|revised|read|learned)\s+(.+?)(?:\s+for\s|\s*$)')
+NOTES_PATTERN = re.compile(r'notes?:\s*(.+)', re.IGNORECASE)
+
+# progress_tracking metric_name used for study goals
+GOAL_METRIC = "goal"
+
+# Weekdays in report order (Monday first, matching datetime.weekday())
+WEEKDAY_NAMES = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
 class TrackerAgent(BaseAgent):
     """Agent responsible for tracking study progress and performance metrics."""
     
@@ -133,30 +162,28 @@ class TrackerAgent(BaseAgent):
             if not user:
                 return "You haven't logged any study sessions yet. Start by saying 'I studied [topic] for [duration] minutes'"
             
-            # Query sessions
-            sessions = db.query(StudySession).filter(StudySession.user_id == user.id).all()
-            
-            if not sessions:
+            # Calculate time-based statistics in the database
+            today_start = datetime.combine(datetime.now().date(), datetime.min.time())
+            tomorrow_start = today_start + timedelta(days=1)
+            week_start = today_start - timedelta(days=today_start.weekday())
+            
+            session_count, daily_time, weekly_time, total_time = db.query(
+                func.count(StudySession.id),
+                func.coalesce(func.sum(case(
+                    (and_(StudySession.completed_at >= today_start, StudySession.completed_at < tomorrow_start),
+                     StudySession.duration_minutes),
+                    else_=0
+                )), 0),
+                func.coalesce(func.sum(case(
+                    (StudySession.completed_at >= week_start, StudySession.duration_minutes),
+                    else_=0
+                )), 0),
+                func.coalesce(func.sum(StudySession.duration_minutes), 0)
+            ).filter(StudySession.user_id == user.id).one()
+            
+            if not session_count:
                 return "You haven't logged any study sessions yet. Start by saying 'I studied [topic] for [duration] minutes'"
             
-            # Calculate time-based statistics
-            today = datetime.now().date()
-            week_start = today - timedelta(days=today.weekday())
-            
-            daily_time = sum(
-                s.duration_minutes
-                for s in sessions
-                if s.completed_at.date() == today
-            )
-            
-            weekly_time = sum(
-                s.duration_minutes
-                for s in sessions
-                if s.completed_at.date() >= week_start
-            )
-            
-            total_time = sum(s.duration_minutes for s in sessions)
-            
             # Generate progress report
             response = (
                 "📊 *Your Study Progress* 📊\n\n"
@@ -166,14 +193,14 @@ class TrackerAgent(BaseAgent):
                 "*📚 Topics Covered This Week:*\n"
             )
             
-            # Get recent topics
-            recent_topics = {}
-            # Sort by date descending
-            sorted_sessions = sorted(sessions, key=lambda x: x.completed_at, reverse=True)
+            # Get recent topics from the last 10 sessions, newest first
+            recent_sessions = db.query(StudySession.topic, StudySession.duration_minutes).filter(
+                StudySession.user_id == user.id
+            ).order_by(StudySession.completed_at.desc()).limit(10).all()
             
-            for session in sorted_sessions[:10]:  # Last 10 sessions
-                topic = session.topic or "Unknown Topic"
-                duration = session.duration_minutes
+            recent_topics = {}
+            for topic, duration in recent_sessions:
+                topic = topic or "Unknown Topic"
                 if topic in recent_topics:
                     recent_topics[topic] += duration
                 else:
@@ -200,29 +227,30 @@ class TrackerAgent(BaseAgent):
             if not user:
                 return "You haven't logged any study sessions yet."
             
-            sessions = db.query(StudySession).filter(StudySession.user_id == user.id).all()
-            
-            if not sessions:
+            # Total minutes per (weekday, hour) bucket; at most 168 rows per user
+            day_of_week = extract('dow', StudySession.completed_at)
+            hour_of_day = extract('hour', StudySession.completed_at)
+            buckets = db.query(
+                day_of_week, hour_of_day, func.sum(StudySession.duration_minutes)
+            ).filter(
+                StudySession.user_id == user.id,
+                StudySession.completed_at.isnot(None)
+            ).group_by(day_of_week, hour_of_day).all()
+            
+            if not buckets:
                 return "You haven't logged any study sessions yet."
             
-            # Calculate time distribution by day of week
+            # Calculate time distribution by day of week and most productive time of day
             day_distribution = {}
-            for session in sessions:
-                day = session.completed_at.strftime("%A")
-                duration = session.duration_minutes
-                if day in day_distribution:
-                    day_distribution[day] += duration
-                else:
-                    day_distribution[day] = duration
-            
-            # Calculate most productive time of day
             time_distribution = {"Morning (6AM-12PM)": 0, "Afternoon (12PM-5PM)": 0, 
                                "Evening (5PM-10PM)": 0, "Night (10PM-6AM)": 0}
             
-            for session in sessions:
-                hour = session.completed_at.hour
-                duration = session.duration_minutes
+            for dow, hour, duration in buckets:
+                # dow counts from Sunday = 0
+                day = WEEKDAY_NAMES[(int(dow) + 6) % 7]
+                day_distribution[day] = day_distribution.get(day, 0) + duration
                 
+                hour = int(hour)
                 if 6 <= hour < 12:
                     time_distribution["Morning (6AM-12PM)"] += duration
                 elif 12 <= hour < 17:
@@ -239,7 +267,7 @@ class TrackerAgent(BaseAgent):
             )
             
             # Add day distribution
-            for day in ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]:
+            for day in WEEKDAY_NAMES:
                 minutes = day_distribution.get(day, 0)
                 hours = minutes / 60
                 response += f"• {day[:3]}: {minutes} min ({hours:.1f} hrs)\n"
@@ -272,15 +300,15 @@ class TrackerAgent(BaseAgent):
     
     async def _manage_goals(self, phone_number: str, message: str) -> str:
         """Manage study goals (set, update, or view)."""
+        db: Session = SessionLocal()
         try:
-            if phone_number not in self.performance_metrics:
-                self.performance_metrics[phone_number] = self._get_default_metrics()
-            
-            metrics = self.performance_metrics[phone_number]
+            user = self._get_or_create_user(db, phone_number)
             
-            # Initialize goals if not exists
-            if "goals" not in metrics:
-                metrics["goals"] = {}
+            # Goals are stored as progress_tracking rows, oldest first
+            goals = db.query(ProgressTracking).filter(
+                ProgressTracking.user_id == user.id,
+                ProgressTracking.metric_name == GOAL_METRIC
+            ).order_by(ProgressTracking.recorded_at).all()
             
             # Parse goal command
             if "set" in message.lower() or "create" in message.lower():
@@ -289,82 +317,88 @@ class TrackerAgent(BaseAgent):
                 target = 60  # Default target (60 minutes)
                 
                 # Look for numbers in the message
-                import re
-                number_match = re.search(r'(\d+)', message)
+                number_match = NUMBER_PATTERN.search(message)
                 if number_match:
                     target = int(number_match.group(1))
                 
                 # Look for goal name
-                name_match = re.search(r'goal (?:to|for) (.+?) (?:for|in)', message.lower())
+                name_match = GOAL_NAME_PATTERN.search(message.lower())
                 if name_match:
                     goal_name = name_match.group(1).title()
                 
                 # Create or update goal
-                metrics["goals"][goal_name] = {
+                goal = next((g for g in goals if g.details.get("name") == goal_name), None)
+                if goal is None:
+                    goal = ProgressTracking(user_id=user.id, metric_name=GOAL_METRIC)
+                    db.add(goal)
+                goal.metric_value = 0
+                goal.details = {
+                    "name": goal_name,
                     "target": target,
                     "current": 0,
                     "unit": "minutes",
                     "created_at": datetime.now().isoformat()
                 }
+                db.commit()
                 
                 return f"✅ Goal set! {goal_name}: 0/{target} minutes"
                 
             elif "update" in message.lower() or "progress" in message.lower():
                 # Update goal progress
                 # This is a simplified version - in a real app, you'd parse which goal to update
-                if not metrics["goals"]:
+                if not goals:
                     return "You don't have any goals set yet. Say 'set a goal to study [X] minutes per day'"
                 
                 # For simplicity, update the first goal
-                goal_name = next(iter(metrics["goals"]))
-                goal = metrics["goals"][goal_name]
+                goal = goals[0]
+                details = goal.details
+                goal_name = details["name"]
                 
                 # Look for numbers in the message
-                import re
-                number_match = re.search(r'(\d+)', message)
+                number_match = NUMBER_PATTERN.search(message)
                 if number_match:
                     progress = int(number_match.group(1))
-                    goal["current"] = min(goal["current"] + progress, goal["target"])
+                    current = min(details["current"] + progress, details["target"])
                     
-                    percentage = (goal["current"] / goal["target"]) * 100
-                    return f"✅ Progress updated! {goal_name}: {goal['current']}/{goal['target']} minutes ({percentage:.1f}%)"
+                    # Reassign so SQLAlchemy sees the JSON change
+                    goal.details = {**details, "current": current}
+                    goal.metric_value = current
+                    db.commit()
+                    
+                    percentage = (current / details["target"]) * 100
+                    return f"✅ Progress updated! {goal_name}: {current}/{details['target']} minutes ({percentage:.1f}%)"
                 else:
                     return "Please specify how much progress you've made (e.g., 'I studied 30 minutes')"
                 
             else:
                 # View goals
-                if not metrics["goals"]:
+                if not goals:
                     return "You don't have any goals set yet. Say 'set a goal to study [X] minutes per day'"
                 
                 response = "🎯 *Your Study Goals* 🎯\n\n"
                 
-                for name, goal in metrics["goals"].items():
-                    percentage = (goal["current"] / goal["target"]) * 100
+                for goal in goals:
+                    details = goal.details
+                    percentage = (details["current"] / details["target"]) * 100
                     response += (
-                        f"*{name}*\n"
-                        f"Progress: {goal['current']}/{goal['target']} {goal.get('unit', 'minutes')} ({percentage:.1f}%)\n"
-                        f"Set on: {datetime.fromisoformat(goal['created_at']).strftime('%b %d, %Y')}\n\n"
+                        f"*{details['name']}*\n"
+                        f"Progress: {details['current']}/{details['target']} {details.get('unit', 'minutes')} ({percentage:.1f}%)\n"
+                        f"Set on: {datetime.fromisoformat(details['created_at']).strftime('%b %d, %Y')}\n\n"
                     )
                 
                 response += "To update progress, say 'I studied [X] minutes today'"
                 return response
                 
         except Exception as e:
+            db.rollback()
             logger.error(f"Error managing goals: {str(e)}", exc_info=True)
             return "I couldn't process your goal request. Please try again with the format: 'Set a goal to study [X] minutes per day'"
+        finally:
+            db.close()
     
     def _parse_intent(self, message: str) -> List[str]:
         """Parse the user's intent from their message."""
-        intents = []
-        
-        if any(word in message for word in ["log", "add", "studied", "completed"]):
-            intents.append("log")
-        if any(word in message for word in ["view", "show", "my progress", "my stats"]):
-            intents.append("view")
-        if any(word in message for word in ["analytics", "stats", "insights"]):
-            intents.append("analytics")
-        if any(word in message for word in ["goal", "target", "objective"]):
-            intents.append("goal")
+        intents = intent_matcher.find(message)
         
         return intents if intents else ["help"]
     
@@ -372,26 +406,25 @@ class TrackerAgent(BaseAgent):
         """Parse study session data from the user's message."""
         session_data = {}
         
-        # Look for duration (e.g., "30 minutes", "2 hours")
-        import re
+        message_lower = message.lower()
         
-        # Match duration in minutes
-        min_match = re.search(r'(\d+)\s*(?:min|minutes|mins|m)\b', message.lower())
+        # Look for duration (e.g., "30 minutes", "2 hours")
+        min_match = MINUTES_PATTERN.search(message_lower)
         if min_match:
             session_data["duration"] = int(min_match.group(1))
         else:
             # Match duration in hours
-            hr_match = re.search(r'(\d+)\s*(?:hr|hour|hours|h)\b', message.lower())
+            hr_match = HOURS_PATTERN.search(message_lower)
             if hr_match:
                 session_data["duration"] = int(hr_match.group(1)) * 60
         
         # Extract topic (text between "studied" and "for" or end of string)
-        topic_match = re.search(r'(?:studied|completed|revised|read|learned)\s+(.+?)(?:\s+for\s|\s*$)', message.lower())
+        topic_match = TOPIC_PATTERN.search(message_lower)
         if topic_match:
             session_data["topic"] = topic_match.group(1).strip().title()
         
         # Extract notes (text after "notes:")
-        notes_match = re.search(r'notes?:\s*(.+)', message, re.IGNORECASE)
+        notes_match = NOTES_PATTERN.search(message)
         if notes_match:
             session_data["notes"] = notes_match.group(1).strip()
         
@@ -2,6 +2,7 @@
 Tutor Agent for handling educational queries and providing detailed responses.
 Uses RAG (Retrieval-Augmented Generation) to provide accurate and relevant answers.
 """
+import asyncio
 import logging
 from typing import Dict, Any, Optional
 
@@ -54,8 +55,8 @@ class TutorAgent(BaseAgent):
             if not message.strip():
                 return "I didn't catch that. Could you please rephrase your question?"
             
-            # Process the query using RAG
-            response = self.rag.retrieve_and_generate(message)
+            # Process the query using RAG (embedding, retrieval and the LLM call block)
+            response = await asyncio.to_thread(self.rag.retrieve_and_generate, message)
             return self._format_response(response, message)
             
         except Exception as e:
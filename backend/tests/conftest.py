@@ -0,0 +1,60 @@
+"""
+Shared fixtures for the RAGService tests.
+Chroma and the embedding model are replaced with in-memory fakes.
+"""
+import pytest
+
+class FakeCollection:
+    """Records queries; the "embeddings" are the query texts themselves."""
+
+    def __init__(self, metadata=None):
+        self.metadata = metadata or {}
+        self.calls = []
+        self.modify_calls = []
+        self.error = None
+
+    def modify(self, metadata=None):
+        self.modify_calls.append(metadata)
+        self.metadata = {**self.metadata, **metadata}
+
+    def query(self, query_embeddings, n_results):
+        self.calls.append((list(query_embeddings), n_results))
+        if self.error:
+            raise self.error
+        return {"documents": [[f"{text}-{i}" for i in range(n_results)] for text in query_embeddings]}
+
+@pytest.fixture
+def make_service(monkeypatch, tmp_path):
+    """Return a factory building a fresh RAGService over a fake collection with the given stored metadata."""
+    pytest.importorskip("chromadb")
+    from backend.services import rag_service
+    from backend.services.rag_service import RAGService
+
+    monkeypatch.chdir(tmp_path)  # RAGService creates ./data/chroma
+    monkeypatch.setattr(
+        rag_service.embedding_functions,
+        "SentenceTransformerEmbeddingFunction",
+        lambda model_name: (lambda texts: list(texts))
+    )
+
+    def make(metadata=None):
+        collection = FakeCollection(metadata)
+
+        class FakeClient:
+            def __init__(self, path):
+                pass
+
+            def get_or_create_collection(self, name, metadata=None):
+                if not collection.metadata:  # New collection
+                    collection.metadata = dict(metadata or {})
+                return collection
+
+        monkeypatch.setattr(rag_service.chromadb, "PersistentClient", FakeClient)
+        monkeypatch.setattr(RAGService, "_instance", None)
+        return RAGService(llm_service=object())
+
+    return make
+
+@pytest.fixture
+def service(make_service):
+    return make_service()
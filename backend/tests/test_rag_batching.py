@@ -0,0 +1,76 @@
+"""
+Tests for RAGService.aretrieve, which batches concurrent lookups into one Chroma query.
+Chroma and the embedding model are replaced with in-memory fakes (see conftest.py).
+"""
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip("chromadb")
+
+def test_concurrent_lookups_share_one_query(service):
+    async def lookups():
+        return await asyncio.gather(
+            service.aretrieve("polity", 2),
+            service.aretrieve("history", 2),
+            service.aretrieve(" Polity ", 2)
+        )
+
+    results = asyncio.run(lookups())
+
+    assert results == [["polity-0", "polity-1"], ["history-0", "history-1"], ["polity-0", "polity-1"]]
+    assert service.collection.calls == [(["polity", "history"], 2)]
+    assert service.pending_queries == {} and service.batch_tasks == {}
+
+def test_lookups_are_grouped_by_n_results(service):
+    async def lookups():
+        return await asyncio.gather(service.aretrieve("polity", 1), service.aretrieve("history", 2))
+
+    assert asyncio.run(lookups()) == [["polity-0"], ["history-0", "history-1"]]
+    assert sorted(service.collection.calls) == [(["history"], 2), (["polity"], 1)]
+
+def test_lone_lookup_skips_batch_window(service):
+    service.batch_window = 60
+
+    async def lookup():
+        return await asyncio.wait_for(service.aretrieve("polity", 1), timeout=5)
+
+    assert asyncio.run(lookup()) == ["polity-0"]
+
+def test_cached_lookup_does_not_query(service):
+    asyncio.run(service.aretrieve("polity", 1))
+    asyncio.run(service.aretrieve("POLITY", 1))
+
+    assert len(service.collection.calls) == 1
+
+def test_query_error_reaches_every_waiter(service):
+    service.collection.error = RuntimeError("chroma down")
+
+    async def lookups():
+        return await asyncio.gather(
+            service.aretrieve("polity", 2),
+            service.aretrieve("history", 2),
+            service.aretrieve("polity", 2),
+            return_exceptions=True
+        )
+
+    results = asyncio.run(lookups())
+
+    assert all(result is service.collection.error for result in results)
+    assert service.pending_queries == {} and service.batch_tasks == {}
+
+def test_event_loops_in_different_threads_get_their_own_queue(service):
+    results = {}
+
+    def lookup(query):
+        results[query] = asyncio.run(service.aretrieve(query, 1))
+
+    threads = [threading.Thread(target=lookup, args=(query,)) for query in ("polity", "history", "geography")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert results == {"polity": ["polity-0"], "history": ["history-0"], "geography": ["geography-0"]}
+    assert service.pending_queries == {} and service.batch_tasks == {}
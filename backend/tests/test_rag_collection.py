@@ -0,0 +1,30 @@
+"""
+Tests for how RAGService opens the ncert_corpus collection.
+"""
+import pytest
+
+pytest.importorskip("chromadb")
+
+from backend.config import settings
+
+def test_search_ef_is_applied_without_build_parameters(make_service):
+    service = make_service({
+        "hnsw:space": "cosine",
+        "hnsw:M": 16,
+        "hnsw:construction_ef": 100,
+        "hnsw:search_ef": settings.HNSW_SEARCH_EF + 1
+    })
+
+    assert service.collection.modify_calls == [{"hnsw:search_ef": settings.HNSW_SEARCH_EF}]
+
+def test_matching_search_ef_is_left_alone(make_service):
+    service = make_service({"hnsw:space": "cosine", "hnsw:search_ef": settings.HNSW_SEARCH_EF})
+
+    assert service.collection.modify_calls == []
+
+def test_new_collection_is_created_with_build_parameters(make_service):
+    service = make_service()
+
+    assert service.collection.metadata["hnsw:space"] == "cosine"
+    assert service.collection.metadata["hnsw:M"] == settings.HNSW_M
+    assert service.collection.modify_calls == []
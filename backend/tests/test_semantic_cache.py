@@ -0,0 +1,73 @@
+"""
+Tests for SemanticCache, the embedding-keyed answer cache used by RAGService.
+"""
+from backend.utils.semantic_cache import SemanticCache, key_tokens, same_key_tokens
+
+CONTEXT = "context-a"
+
+def test_hit_for_same_embedding_and_context():
+    cache = SemanticCache(size=4)
+    cache.add([1.0, 0.0, 0.0], "What is the Preamble?", CONTEXT, "answer")
+
+    assert cache.lookup([2.0, 0.0, 0.0], "what is the preamble", CONTEXT) == "answer"
+
+def test_miss_for_unrelated_embedding():
+    cache = SemanticCache(size=4)
+    cache.add([1.0, 0.0, 0.0], "What is the Preamble?", CONTEXT, "answer")
+
+    assert cache.lookup([0.0, 1.0, 0.0], "Explain fundamental rights", CONTEXT) is None
+    assert cache.lookup([0.0, 0.0, 0.0], "What is the Preamble?", CONTEXT) is None
+
+def test_miss_for_different_context():
+    cache = SemanticCache(size=4)
+    cache.add([1.0, 0.0, 0.0], "What is the Preamble?", CONTEXT, "answer")
+
+    assert cache.lookup([1.0, 0.0, 0.0], "What is the Preamble?", "context-b") is None
+
+def test_threshold():
+    cache = SemanticCache(size=4, threshold=0.97)
+    cache.add([1.0, 0.0], "What is the Preamble?", CONTEXT, "answer")
+
+    # cos = 0.98 and 0.96
+    assert cache.lookup([0.98, 0.198997], "What is the Preamble?", CONTEXT) == "answer"
+    assert cache.lookup([0.96, 0.28], "What is the Preamble?", CONTEXT) is None
+
+def test_ring_buffer_overwrites_oldest():
+    cache = SemanticCache(size=2)
+    cache.add([1.0, 0.0, 0.0], "q1", CONTEXT, "a1")
+    cache.add([0.0, 1.0, 0.0], "q2", CONTEXT, "a2")
+    cache.add([0.0, 0.0, 1.0], "q3", CONTEXT, "a3")
+
+    assert cache.count == 2
+    assert cache.lookup([1.0, 0.0, 0.0], "q1", CONTEXT) is None
+    assert cache.lookup([0.0, 1.0, 0.0], "q2", CONTEXT) == "a2"
+    assert cache.lookup([0.0, 0.0, 1.0], "q3", CONTEXT) == "a3"
+
+def test_near_duplicates_with_different_numbers_or_names_miss():
+    cache = SemanticCache(size=4)
+    # Identical embeddings stand in for near-duplicate questions
+    cache.add([1.0, 0.0], "What does Article 14 say?", CONTEXT, "article 14")
+    cache.add([0.0, 1.0], "Goals of the first Five-Year Plan", CONTEXT, "first plan")
+
+    assert cache.lookup([1.0, 0.0], "What does Article 15 say?", CONTEXT) is None
+    assert cache.lookup([0.0, 1.0], "Goals of the second Five-Year Plan", CONTEXT) is None
+    assert cache.lookup([1.0, 0.0], "What does Article 14 state?", CONTEXT) == "article 14"
+
+def test_best_matching_entry_wins():
+    cache = SemanticCache(size=4, threshold=0.9)
+    cache.add([1.0, 0.3], "Who was Ashoka?", CONTEXT, "ashoka, close")
+    cache.add([1.0, 0.0], "Who was Akbar?", CONTEXT, "akbar")
+    cache.add([1.0, 0.1], "Who was Ashoka?", CONTEXT, "ashoka, closest")
+
+    assert cache.lookup([1.0, 0.0], "Who was Ashoka?", CONTEXT) == "ashoka, closest"
+
+def test_key_tokens():
+    numbers, names, _ = key_tokens("What does Article 14 say about the 42nd Amendment?")
+    assert numbers == {"14", "42nd"}
+    assert names == {"article", "amendment"}
+
+def test_same_key_tokens():
+    assert same_key_tokens(key_tokens("Who was Ashoka?"), key_tokens("tell me about ashoka"))
+    assert not same_key_tokens(key_tokens("Who was Ashoka?"), key_tokens("Who was Akbar?"))
+    assert not same_key_tokens(key_tokens("who was ashoka"), key_tokens("Who was Akbar?"))
+    assert not same_key_tokens(key_tokens("Article 14"), key_tokens("Article 14 and 21"))
@@ -0,0 +1,17 @@
+"""
+Tests for parse_subjects, shared by the onboarding and planner flows.
+"""
+from backend.services.onboarding_service import parse_subjects
+
+def test_subjects_in_mention_order():
+    assert parse_subjects("Economy, polity and history") == ["Economics", "Indian Polity", "Indian History"]
+
+def test_keywords_must_start_a_word():
+    assert parse_subjects("their history and economy") == ["Indian History", "Economics"]
+    assert parse_subjects("FIRST polity") == ["Indian Polity"]
+
+def test_defaults_to_general_studies():
+    assert parse_subjects("prehistory") == ["General Studies"]
+
+def test_longest_keyword_wins():
+    assert parse_subjects("international relations and IR") == ["International Relations"]
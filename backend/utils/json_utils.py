@@ -0,0 +1,39 @@
+"""
+JSON encoding for payloads stored in text columns (study plans, quiz data).
+Uses orjson when the package is installed, otherwise the standard library.
+"""
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # Optional dependency
+    orjson = None
+
+def dumps(obj: Any) -> str:
+    """
+    Serialize an object to a JSON string.
+
+    Args:
+        obj: JSON-compatible value (datetimes are also accepted when orjson is available)
+
+    Returns:
+        The encoded JSON text
+    """
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj)
+
+def loads(data: Any) -> Any:
+    """
+    Parse JSON text (str or bytes) back into Python objects.
+
+    Args:
+        data: Encoded JSON
+
+    Returns:
+        The decoded value
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
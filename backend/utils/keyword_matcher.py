@@ -0,0 +1,51 @@
+"""
+Multi-keyword substring matching for the intent and planner parsers.
+Uses a pyahocorasick automaton when the package is installed, otherwise
+falls back to plain substring checks.
+"""
+from typing import Any, Dict, List
+
+try:
+    import ahocorasick
+except ImportError:  # Optional dependency
+    ahocorasick = None
+
+class KeywordMatcher:
+    """Find which of a fixed set of keywords occur in a piece of text."""
+
+    def __init__(self, keywords: Dict[str, Any]):
+        """
+        Build the matcher once for a keyword -> value mapping.
+
+        Args:
+            keywords: Mapping of lowercase keyword to the value reported when it is found
+        """
+        self.keywords = dict(keywords)
+        self.order = {keyword: i for i, keyword in enumerate(self.keywords)}
+        self.automaton = None
+
+        if ahocorasick is not None and self.keywords:
+            self.automaton = ahocorasick.Automaton()
+            for keyword in self.keywords:
+                self.automaton.add_word(keyword, keyword)
+            self.automaton.make_automaton()
+
+    def find(self, text_lower: str) -> List[Any]:
+        """
+        Return the values of all keywords contained in the text.
+
+        Args:
+            text_lower: Lowercased text to scan
+
+        Returns:
+            Matched values in keyword declaration order, without duplicates
+        """
+        if self.automaton is not None:
+            found = sorted(
+                {keyword for _, keyword in self.automaton.iter(text_lower)},
+                key=self.order.__getitem__
+            )
+        else:
+            found = [keyword for keyword in self.keywords if keyword in text_lower]
+
+        return list(dict.fromkeys(self.keywords[keyword] for keyword in found))
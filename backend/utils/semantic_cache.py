@@ -0,0 +1,121 @@
+"""
+Embedding-keyed response cache for the RAG tutor.
+Returns a stored answer when a new question's embedding is close enough
+(cosine similarity) to one that was already answered from the same study
+material, and both questions mention the same numbers and names.
+"""
+import re
+import threading
+from typing import Any, FrozenSet, List, Optional, Tuple
+
+import numpy as np
+
+# Numbers and ordinals ("Article 14", "42nd Amendment", "second Five-Year Plan")
+NUMBER_PATTERN = re.compile(
+    r'\b(?:\d+(?:\.\d+)?(?:st|nd|rd|th)?|first|second|third|fourth|fifth|sixth|'
+    r'seventh|eighth|ninth|tenth|eleventh|twelfth)\b',
+    re.IGNORECASE
+)
+# Capitalised words, a cheap stand-in for named entities
+NAME_PATTERN = re.compile(r'\b[A-Z][\w-]+')
+WORD_PATTERN = re.compile(r'[\w-]+')
+
+# (numbers, names, all words) of a question, lowercased
+KeyTokens = Tuple[FrozenSet[str], FrozenSet[str], FrozenSet[str]]
+
+def key_tokens(text: str) -> KeyTokens:
+    """Return the numbers, capitalised names (other than the first word) and words of a question."""
+    text = text.strip()
+    return (
+        frozenset(match.group().lower() for match in NUMBER_PATTERN.finditer(text)),
+        frozenset(match.group().lower() for match in NAME_PATTERN.finditer(text) if match.start()),
+        frozenset(word.lower() for word in WORD_PATTERN.findall(text))
+    )
+
+def same_key_tokens(a: KeyTokens, b: KeyTokens) -> bool:
+    """
+    Check that two questions can share an answer.
+
+    Near-duplicate questions such as "Article 14" and "Article 15" embed almost
+    identically, so their numbers must be equal, and each question's names must
+    appear (in any case) in the other.
+    """
+    return a[0] == b[0] and a[1] <= b[2] and b[1] <= a[2]
+
+class SemanticCache:
+    """Fixed-size cache of (query embedding, answer) pairs with nearest-match lookup."""
+
+    def __init__(self, size: int = 512, threshold: float = 0.97):
+        """
+        Create an empty cache.
+
+        Args:
+            size: Maximum number of answers kept; the oldest is overwritten when full
+            threshold: Minimum cosine similarity for a lookup to count as a hit
+        """
+        self.size = size
+        self.threshold = threshold
+        self.vectors: Optional[np.ndarray] = None  # Unit-length embeddings, one row per slot
+        # (context key, key tokens, answer) for each slot
+        self.entries: List[Optional[Tuple[str, KeyTokens, str]]] = [None] * size
+        self.count = 0
+        self.next_slot = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding: Any) -> Optional[np.ndarray]:
+        """Return the embedding as a unit-length float32 vector, or None if it is all zeros."""
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def lookup(self, embedding: Any, query: str, context_key: str) -> Optional[str]:
+        """
+        Return the answer stored for the most similar earlier query.
+
+        Args:
+            embedding: Embedding of the incoming query
+            query: Text of the incoming query
+            context_key: Identifies the retrieved study material the answer is based on
+
+        Returns:
+            The cached answer, or None if nothing is similar enough
+        """
+        vector = self._normalize(embedding)
+        tokens = key_tokens(query)
+        with self.lock:
+            if vector is None or not self.count or vector.shape[0] != self.vectors.shape[1]:
+                return None
+            similarities = self.vectors[:self.count] @ vector
+            # Check the slots above the threshold, best match first
+            candidates = np.flatnonzero(similarities >= self.threshold)
+            for slot in candidates[np.argsort(-similarities[candidates])]:
+                entry_context, entry_tokens, answer = self.entries[slot]
+                if entry_context == context_key and same_key_tokens(entry_tokens, tokens):
+                    return answer
+        return None
+
+    def add(self, embedding: Any, query: str, context_key: str, answer: str) -> None:
+        """
+        Store an answer under its query embedding.
+
+        Args:
+            embedding: Embedding of the answered query
+            query: Text of the answered query
+            context_key: Identifies the retrieved study material the answer is based on
+            answer: The generated answer
+        """
+        vector = self._normalize(embedding)
+        if vector is None:
+            return
+        tokens = key_tokens(query)
+        with self.lock:
+            if self.vectors is None or vector.shape[0] != self.vectors.shape[1]:
+                self.vectors = np.zeros((self.size, vector.shape[0]), dtype=np.float32)
+                self.entries = [None] * self.size
+                self.count = 0
+                self.next_slot = 0
+            self.vectors[self.next_slot] = vector
+            self.entries[self.next_slot] = (context_key, tokens, answer)
+            self.next_slot = (self.next_slot + 1) % self.size
+            self.count = min(self.count + 1, self.size)
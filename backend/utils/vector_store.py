@@ -0,0 +1,28 @@
+"""
+Shared definition of the ncert_corpus Chroma collection.
+Used by RAGService and ingestion/ncert_ingest.py so the collection is created
+with the same index settings whichever of them runs first.
+"""
+from typing import Any, Dict
+
+from ..config import settings
+
+# Name of the collection holding the embedded NCERT chunks
+NCERT_COLLECTION = "ncert_corpus"
+
+def ncert_collection_metadata() -> Dict[str, Any]:
+    """
+    Metadata for creating the NCERT collection.
+
+    Chroma only applies the HNSW build parameters (space, M, construction_ef)
+    when the collection is created; changing them later requires deleting the
+    collection and re-running the ingestion. search_ef is the only setting
+    RAGService re-applies to an existing collection.
+    """
+    return {
+        "hnsw:space": "cosine",  # Use cosine similarity for text
+        "hnsw:M": settings.HNSW_M,
+        "hnsw:construction_ef": settings.HNSW_CONSTRUCTION_EF,
+        "hnsw:search_ef": settings.HNSW_SEARCH_EF,
+        "embedding_model": settings.EMBEDDING_MODEL  # Checked by RAGService on startup
+    }
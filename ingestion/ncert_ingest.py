@@ -1,18 +1,32 @@
 import os
+import sys
 import uuid
+from pathlib import Path
+
 import pdfplumber
 import chromadb
 from sentence_transformers import SentenceTransformer
 
+# Make the backend package importable when run as a script
+# (python ingestion/ncert_ingest.py) as well as with python -m
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from backend.config import settings
+from backend.utils.vector_store import NCERT_COLLECTION, ncert_collection_metadata
+
 PDF_DIR = "./data/ncert/"
 CHROMA_DIR = "./data/chroma"
 
 def main():
     print("🚀 Starting NCERT PDF ingestion...\n")
-    model = SentenceTransformer("all-MiniLM-L6-v2")
+    # RAGService embeds queries with the same settings.EMBEDDING_MODEL. After
+    # changing it, delete the ncert_corpus collection and re-run this script.
+    model = SentenceTransformer(settings.EMBEDDING_MODEL)
 
     client = chromadb.PersistentClient(path=CHROMA_DIR)
-    coll = client.get_or_create_collection("ncert_corpus")
+    # Index settings only apply when the collection is created; to change the
+    # HNSW build parameters, delete the collection and re-run this script
+    coll = client.get_or_create_collection(NCERT_COLLECTION, metadata=ncert_collection_metadata())
 
     total_docs, total_chunks = 0, 0
 